@@ -1,12 +1,65 @@
 import argparse
 
+
+def add_model_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options of the models given to get_agent_model."""
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the model response cache (disabled if not provided)",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        type=str,
+        choices=["record", "replay"],
+        default="record",
+        help="Whether to store cache misses ('record') or fail on them ('replay')",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=3,
+        help="Maximum number of retries of model requests failing with transient errors",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a second request when the first one is slower than the 95th percentile of the previous ones",
+    )
+    parser.add_argument(
+        "--router-stats-file",
+        type=str,
+        default=None,
+        help="File to keep the stats of the routed models in across runs (when routing between several models)",
+    )
+
+
+def add_compaction_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options of the context compaction (see ContextCompactor)."""
+    parser.add_argument(
+        "--max-input-tokens",
+        type=int,
+        default=None,
+        help="Budget of input tokens per model call, over which the observations of the oldest steps are compacted (disabled if not provided)",
+    )
+    parser.add_argument(
+        "--compaction-strategy",
+        type=str,
+        choices=["truncate", "drop"],
+        default="truncate",
+        help="Whether to truncate the compacted observations ('truncate') or replace them with a placeholder ('drop')",
+    )
+
+
 parser = argparse.ArgumentParser(description="Run the script with a specific model ID.")
 parser.add_argument(
     "-m",
     "--model-id",
     type=str,
     required=True,
-    help="Identifier of the model to use (e.g., 'Claude-Sonnet-3.7', 'Gemini-2.5-Flash')",
+    help="Identifier of the model to use (e.g., 'Claude-Sonnet-3.7', 'Gemini-2.5-Flash'), "
+    "or comma separated identifiers, optionally weighted, to route between (e.g., 'Kimi-K2:2,GPT-5')",
 )
 parser.add_argument(
     "-a",
@@ -16,4 +69,33 @@ parser.add_argument(
     default="code",
     help="Identifier of kindf of agent to use",
 )
-args = parser.parse_args()
+parser.add_argument(
+    "--trace-file",
+    type=str,
+    default=None,
+    help="File to export a trace of the run to, as OTLP/JSON if it ends with .otlp.json, as a Chrome trace otherwise",
+)
+add_model_arguments(parser)
+add_compaction_arguments(parser)
+parser.add_argument(
+    "--delegation-cache-ttl",
+    type=float,
+    default=600.0,
+    help="Seconds during which repeated delegations of a manager to a managed agent reuse the earlier answer (0 to disable)",
+)
+parser.add_argument(
+    "--checkpoint-dir",
+    type=str,
+    default=None,
+    help="Directory to checkpoint the session of the agents to, and to resume it from",
+)
+
+
+def __getattr__(name: str):
+    # The arguments are parsed once the scripts import them, so batch_query and
+    # worker_service can import the helpers above for their own parsers
+    if name == "args":
+        global args
+        args = parser.parse_args()
+        return args
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
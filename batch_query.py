@@ -0,0 +1,173 @@
+import argparse
+import json
+import time
+import traceback
+from collections import Counter, deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from smolagents import ActionStep, LogLevel, MultiStepAgent
+
+from args import add_compaction_arguments, add_model_arguments
+from context_compaction import ContextCompactor
+from tool import SystemInfoTool, get_system_info
+from wrapped_agents import WrappedCodeAgent, WrappedToolCallingAgent, get_agent_model
+
+AVAILABLE_TOOLS = {
+    "get_system_info": lambda: get_system_info,
+    "system_info_tool": SystemInfoTool,
+}
+
+
+class ModelScheduler:
+    """Hands out the rows to run, with at most ``per_model_concurrency`` runs per model id.
+
+    Rows of a model without a free slot wait here rather than in a worker of the
+    pool, so they never hold back the rows of other models. Rows are otherwise
+    handed out in order.
+    """
+
+    def __init__(self, rows: list[dict], per_model_concurrency: int):
+        self.per_model_concurrency = per_model_concurrency
+        self._pending: dict[str, deque[int]] = {}
+        for index, row in enumerate(rows):
+            self._pending.setdefault(row["model_id"], deque()).append(index)
+        self._running: Counter[str] = Counter()
+
+    def next_row(self) -> int | None:
+        """Returns the index of the next row which can start, if any."""
+        runnable = [
+            model_id
+            for model_id, indexes in self._pending.items()
+            if indexes and self._running[model_id] < self.per_model_concurrency
+        ]
+        if not runnable:
+            return None
+        model_id = min(runnable, key=lambda model_id: self._pending[model_id][0])
+        self._running[model_id] += 1
+        return self._pending[model_id].popleft()
+
+    def finished(self, model_id: str) -> None:
+        self._running[model_id] -= 1
+
+
+def build_agent(row: dict, batch_args, **kwargs) -> MultiStepAgent:
+    agent_type = row.get("agent_type", "code")
+    agent_class = WrappedCodeAgent if agent_type == "code" else WrappedToolCallingAgent
+    return agent_class(
+        tools=[AVAILABLE_TOOLS[name]() for name in row.get("tools", [])],
+        model=get_agent_model(
+            row["model_id"],
+            cache_dir=batch_args.cache_dir,
+            cache_mode=batch_args.cache_mode,
+            max_retries=batch_args.max_retries,
+            hedge=batch_args.hedge,
+            router_stats_path=batch_args.router_stats_file,
+        ),
+        verbosity_level=LogLevel.OFF,
+        name=f"{agent_type.replace('-', '_')}_agent",
+        return_full_result=True,
+        context_compactor=ContextCompactor(
+            batch_args.max_input_tokens, strategy=batch_args.compaction_strategy
+        )
+        if batch_args.max_input_tokens
+        else None,
+        **kwargs,
+    )
+
+
+def run_agent(get_agent: Callable[[], MultiStepAgent], row: dict) -> dict:
+    """Runs the task of a row on the agent returned by get_agent, and returns the result."""
+    result = {**row, "output": None, "state": None, "error": None}
+    start_time = time.time()
+    try:
+        agent = get_agent()
+        run_result = agent.run(row["task"], max_steps=row.get("max_steps", 3))
+        token_usage = run_result.token_usage
+        result.update(
+            output=str(run_result.output),
+            state=run_result.state,
+            steps=len(
+                [step for step in agent.memory.steps if isinstance(step, ActionStep)]
+            ),
+            input_tokens=token_usage.input_tokens if token_usage else None,
+            output_tokens=token_usage.output_tokens if token_usage else None,
+        )
+    except Exception as e:
+        result.update(
+            state="error",
+            error=f"{type(e).__name__}: {e}",
+            traceback=traceback.format_exc(),
+        )
+    result["duration"] = time.time() - start_time
+    return result
+
+
+def run_task(row: dict, batch_args) -> dict:
+    return run_agent(lambda: build_agent(row, batch_args), row)
+
+
+def run_batch(rows: list[dict], output_path: str, batch_args) -> None:
+    scheduler = ModelScheduler(rows, batch_args.per_model_concurrency)
+    with (
+        open(output_path, "a", encoding="utf-8") as output_file,
+        ThreadPoolExecutor(max_workers=batch_args.max_workers) as executor,
+    ):
+        futures = {}
+
+        def submit_runnable_rows() -> None:
+            # Rows are only submitted when a worker and a slot of their model are free
+            while len(futures) < batch_args.max_workers:
+                index = scheduler.next_row()
+                if index is None:
+                    return
+                futures[executor.submit(run_task, rows[index], batch_args)] = index
+
+        submit_runnable_rows()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = {"index": futures.pop(future), **future.result()}
+                scheduler.finished(result["model_id"])
+                # Results are written as soon as each run finishes
+                output_file.write(json.dumps(result, default=str) + "\n")
+                output_file.flush()
+                print(
+                    f"Run {result['index']} ({result['model_id']}) finished with state "
+                    f"{result['state']} in {result['duration']:.2f}s"
+                )
+            submit_runnable_rows()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a batch of agent tasks concurrently."
+    )
+    parser.add_argument(
+        "input",
+        type=str,
+        help="JSONL file with one run per line: task, model_id, agent_type, max_steps and optionally tools",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=True,
+        help="JSONL file to append results to",
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=8, help="Maximum number of concurrent runs"
+    )
+    parser.add_argument(
+        "--per-model-concurrency",
+        type=int,
+        default=2,
+        help="Maximum number of concurrent runs per model id",
+    )
+    add_model_arguments(parser)
+    add_compaction_arguments(parser)
+    batch_args = parser.parse_args()
+
+    with open(batch_args.input, encoding="utf-8") as input_file:
+        rows = [json.loads(line) for line in input_file if line.strip()]
+    run_batch(rows, batch_args.output, batch_args)
@@ -0,0 +1,306 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+# The wrappers read the Poe settings at import time, the stub server is used instead
+os.environ.setdefault("POE_API_KEY", "benchmark")
+os.environ.setdefault("POE_BASE_URL", "http://127.0.0.1/v1")
+
+from rich.console import Console
+from rich.table import Table
+from smolagents import AgentLogger, LogLevel
+
+import wrapped_agents
+from stub_server import StubPoeServer, StubResponse, message_text
+from tool import get_system_info
+from transcript import export_messages_jsonl, export_messages_text
+
+FLOWS = ("simple", "tool", "structured", "multi-agent")
+AGENT_TYPES = ("code", "tool-calling")
+MODEL_ID = "Stub-Model"
+
+# Adapted from the outputs of Kimi-K2 in out/
+ABOUT_ME = (
+    "I am an AI assistant designed to solve tasks using code and available tools. "
+    "I work through a cycle of thinking, coding, and observing to approach problems "
+    "systematically.\n\nMy key characteristics:\n"
+    "- I can use Python code to perform calculations, data processing, and logical operations\n"
+    "- I solve problems step by step, explaining my reasoning at each stage\n"
+    "- I always provide my final answers through the final_answer tool"
+)
+CODE_STEPS = {
+    "simple": [
+        (
+            "The user is asking me to tell them about myself. I'll use the "
+            "`final_answer` tool to provide this information.",
+            f'about_me = """{ABOUT_ME}"""\nfinal_answer(about_me)',
+        )
+    ],
+    "tool": [
+        (
+            "I will get the system information with the `get_system_info` tool.",
+            "system_info = get_system_info()\nprint(system_info)",
+        ),
+        (
+            "I have the system information, I can now give the final answer.",
+            "final_answer(str(system_info))",
+        ),
+    ],
+    "manager": [
+        (
+            "I will ask the provider agent for the system information.",
+            'system_info = provider_agent(task="Get the system information")\n'
+            "print(system_info)",
+        ),
+        (
+            "The provider agent gave me the system information.",
+            "final_answer(system_info)",
+        ),
+    ],
+}
+CODE_STEPS["structured"] = CODE_STEPS["tool"]
+CODE_STEPS["provider"] = CODE_STEPS["tool"]
+TOOL_CALLING_STEPS = {
+    "simple": [("final_answer", {"answer": ABOUT_ME})],
+    "tool": [
+        ("get_system_info", {}),
+        ("final_answer", {"answer": "The system information was collected."}),
+    ],
+    "manager": [
+        ("provider_agent", {"task": "Get the system information"}),
+        ("final_answer", {"answer": "The provider agent collected it."}),
+    ],
+}
+TOOL_CALLING_STEPS["structured"] = TOOL_CALLING_STEPS["tool"]
+TOOL_CALLING_STEPS["provider"] = TOOL_CALLING_STEPS["tool"]
+
+
+def make_responder(flow: str):
+    """Answers each request with the canned response of the agent and step asking."""
+
+    def respond(body: dict) -> StubResponse:
+        messages = body["messages"]
+        # Managed agents are given their task with their name
+        is_provider = any(
+            "helpful agent named 'provider_agent'" in message_text(message)
+            for message in messages
+            if message["role"] == "user"
+        )
+        script = "provider" if is_provider else "manager"
+        if flow != "multi-agent":
+            script = flow
+        step = sum(message["role"] == "assistant" for message in messages)
+        if body.get("tools"):
+            steps = TOOL_CALLING_STEPS[script]
+            name, arguments = steps[min(step, len(steps) - 1)]
+            return StubResponse(
+                tool_calls=[
+                    {"id": f"call_{step}", "name": name, "arguments": arguments}
+                ]
+            )
+        steps = CODE_STEPS[script]
+        thought, code = steps[min(step, len(steps) - 1)]
+        if body.get("response_format"):
+            return StubResponse(content=json.dumps({"thought": thought, "code": code}))
+        return StubResponse(content=f"Thought: {thought}\n<code>\n{code}\n</code>")
+
+    return respond
+
+
+def build_agent(flow: str, agent_type: str, stream_outputs: bool):
+    agent_class = (
+        wrapped_agents.WrappedCodeAgent
+        if agent_type == "code"
+        else wrapped_agents.WrappedToolCallingAgent
+    )
+    model = wrapped_agents.get_agent_model(MODEL_ID)
+    # Rendered to memory, to include the cost of rendering without the terminal
+    logger = AgentLogger(level=LogLevel.INFO, console=Console(file=io.StringIO()))
+    kwargs = {}
+    if flow == "structured" and agent_type == "code":
+        kwargs["use_structured_outputs_internally"] = True
+    if flow == "multi-agent":
+        provider_agent = agent_class(
+            tools=[get_system_info],
+            model=model,
+            logger=logger,
+            stream_outputs=stream_outputs,
+            name="provider_agent",
+            description="A provider agent, which can fetch system information.",
+        )
+        kwargs["managed_agents"] = [provider_agent]
+    return agent_class(
+        tools=[] if flow in ("simple", "multi-agent") else [get_system_info],
+        model=model,
+        logger=logger,
+        stream_outputs=stream_outputs,
+        name="manager_agent" if flow == "multi-agent" else None,
+        **kwargs,
+    )
+
+
+def run_flow(flow: str, agent_type: str, stream_outputs: bool) -> dict:
+    agent = build_agent(flow, agent_type, stream_outputs)
+    start_time = time.perf_counter()
+    agent.run("Get the system information", max_steps=4)
+    run_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    export_messages_text(agent, io.StringIO())
+    export_messages_jsonl(agent, io.StringIO())
+    export_time = time.perf_counter() - start_time
+    totals = agent.ledger.tree_totals
+    return {
+        "run_time": run_time,
+        "generation_time": totals.generation_time,
+        "parse_time": totals.parse_time,
+        "executor_time": totals.executor_time,
+        "export_time": export_time,
+        "steps": totals.steps,
+        "output_tokens": totals.output_tokens,
+    }
+
+
+def benchmark(flow: str, agent_type: str, stream_outputs: bool, runs: int) -> dict:
+    # Warm up, e.g. the connection pool and the imports done by the agents
+    run_flow(flow, agent_type, stream_outputs)
+    results = [run_flow(flow, agent_type, stream_outputs) for _ in range(runs)]
+    # Allocations are traced in a separate run, tracing slows everything down
+    tracemalloc.start()
+    run_flow(flow, agent_type, stream_outputs)
+    _, peak_allocated = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_run_time = sum(result["run_time"] for result in results)
+    summary = {
+        "flow": flow,
+        "agent_type": agent_type,
+        "stream_outputs": stream_outputs,
+        "runs": runs,
+        "steps": results[0]["steps"],
+        "peak_allocated_kb": peak_allocated / 1024,
+        "runs_per_second": runs / total_run_time,
+        "output_tokens_per_second": sum(result["output_tokens"] for result in results)
+        / total_run_time,
+    }
+    for phase in (
+        "run_time",
+        "generation_time",
+        "parse_time",
+        "executor_time",
+        "export_time",
+    ):
+        summary[f"{phase}_ms"] = statistics.median(
+            result[phase] * 1000 for result in results
+        )
+    return summary
+
+
+def print_summaries(summaries: list[dict]) -> None:
+    table = Table(title="Benchmark (median times in ms)")
+    columns = [
+        ("flow", "Flow"),
+        ("agent_type", "Agent"),
+        ("stream_outputs", "Stream"),
+        ("steps", "Steps"),
+        ("run_time_ms", "Run"),
+        ("generation_time_ms", "Generation"),
+        ("parse_time_ms", "Parse"),
+        ("executor_time_ms", "Executor"),
+        ("export_time_ms", "Export"),
+        ("peak_allocated_kb", "Peak KB"),
+        ("runs_per_second", "Runs/s"),
+        ("output_tokens_per_second", "Tokens/s"),
+    ]
+    for _, title in columns:
+        table.add_column(title, justify="right")
+    for summary in summaries:
+        table.add_row(
+            *(
+                f"{summary[key]:.2f}"
+                if isinstance(summary[key], float)
+                else str(summary[key])
+                for key, _ in columns
+            )
+        )
+    # Wide enough for all the columns, also when the output is not a terminal
+    Console(width=max(Console().width, 160)).print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the wrapped agents offline, against a local stub of the Poe API."
+    )
+    parser.add_argument(
+        "--flows", nargs="+", choices=FLOWS, default=list(FLOWS), help="Flows to run"
+    )
+    parser.add_argument(
+        "--agent-types",
+        nargs="+",
+        choices=AGENT_TYPES,
+        default=list(AGENT_TYPES),
+        help="Kinds of agents to run",
+    )
+    parser.add_argument(
+        "--stream-modes",
+        nargs="+",
+        choices=["stream", "no-stream"],
+        default=["stream", "no-stream"],
+        help="Whether to stream the model outputs",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Number of measured runs per benchmark"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds before the stub server answers each request",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=16,
+        help="Number of characters per streamed chunk",
+    )
+    parser.add_argument(
+        "--chunk-delay",
+        type=float,
+        default=0.0,
+        help="Seconds between streamed chunks",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="JSON file to write the results to, e.g. to compare runs",
+    )
+    benchmark_args = parser.parse_args()
+
+    summaries = []
+    for flow in benchmark_args.flows:
+        with StubPoeServer(
+            make_responder(flow),
+            latency=benchmark_args.latency,
+            chunk_size=benchmark_args.chunk_size,
+            chunk_delay=benchmark_args.chunk_delay,
+        ) as server:
+            wrapped_agents.POE_BASE_URL = server.base_url
+            for agent_type in benchmark_args.agent_types:
+                for stream_mode in benchmark_args.stream_modes:
+                    summaries.append(
+                        benchmark(
+                            flow,
+                            agent_type,
+                            stream_mode == "stream",
+                            benchmark_args.runs,
+                        )
+                    )
+    print_summaries(summaries)
+    if benchmark_args.output:
+        with open(benchmark_args.output, "w", encoding="utf-8") as output_file:
+            json.dump(summaries, output_file, indent=2)
@@ -0,0 +1,436 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections.abc import Callable
+from typing import Any
+
+import smolagents
+from smolagents import (
+    ActionStep,
+    AgentLogger,
+    ChatMessage,
+    LocalPythonExecutor,
+    LogLevel,
+    MemoryStep,
+    MultiStepAgent,
+    PlanningStep,
+    TaskStep,
+    Timing,
+    TokenUsage,
+    ToolCall,
+)
+from smolagents.utils import make_json_serializable
+
+# Restored errors would otherwise be logged again when rebuilt
+_silent_logger = AgentLogger(level=LogLevel.OFF)
+# Bookkeeping variables of the executor, which don't need to be checkpointed
+_EXECUTOR_INTERNAL_VARIABLES = ("_print_outputs", "_operations_count")
+# Values which can't change in place, so they only change when rebound
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None), range)
+
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def _read_json(path: str) -> Any:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+class _LazyField:
+    """Field of a restored step, read from its blob at ``_<name>_path`` when first used."""
+
+    def __init__(self, read: Callable[[str], Any]):
+        self.read = read
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.value_attribute = f"_{name}"
+        self.path_attribute = f"_{name}_path"
+
+    def __get__(self, step: ActionStep | None, owner: type | None = None) -> Any:
+        if step is None:
+            return self
+        path = step.__dict__.get(self.path_attribute)
+        if path is not None:
+            step.__dict__[self.value_attribute] = self.read(path)
+            del step.__dict__[self.path_attribute]
+        return step.__dict__.get(self.value_attribute)
+
+    def __set__(self, step: ActionStep, value: Any) -> None:
+        step.__dict__[self.value_attribute] = value
+        step.__dict__.pop(self.path_attribute, None)
+
+
+class LazyActionStep(ActionStep):
+    """Restored action step, whose large observations and output are only read from disk when used."""
+
+    observations = _LazyField(_read_text)
+    action_output = _LazyField(_read_json)
+
+
+def _blob_name(data: bytes, extension: str) -> str:
+    return f"{hashlib.sha256(data).hexdigest()[:32]}.{extension}"
+
+
+def _message_content(message: ChatMessage | None) -> str | list[dict] | None:
+    return message.content if message is not None else None
+
+
+def _message_dict(message: ChatMessage | None) -> dict | None:
+    if message is None:
+        return None
+    return {
+        "role": message.role,
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": make_json_serializable(tool_call.function.arguments),
+                },
+            }
+            for tool_call in message.tool_calls
+        ]
+        if message.tool_calls
+        else None,
+    }
+
+
+class SessionCheckpoint:
+    """Append-only checkpoint of the sessions of an agent and its managed agents.
+
+    Each step is appended to ``log.jsonl`` in the checkpoint directory as soon as
+    it is finalized, along with the variables of the executor which changed in
+    the step. Observations and action outputs longer than ``max_inline_chars``
+    and the variables are stored out of line, in content addressed files of
+    ``blobs/``, so that identical contents are only stored once. Model input
+    messages are not stored, as they are rebuilt from the memory, and neither is
+    the model output, unless it differs from the content of the output message.
+
+    Attaching an agent to an existing checkpoint resumes its session, without
+    calling the model: the memory of each agent of the tree is restored since its
+    last reset, observations being loaded lazily, and so are the variables of the
+    executors. Following runs with reset=False continue the session, e.g. after a
+    restart or on another worker. Variables which can't be pickled (e.g. functions
+    defined by the code) are not restored, and are listed in
+    ``missing_variables``.
+
+    Detecting which variables changed costs a pickling of every mutable variable
+    at each step, as they may have changed in place. With ``track_mutations``
+    unset, only the variables which were rebound are pickled again, which is
+    cheaper with large objects, but changes made in place to a variable are only
+    saved once it is rebound.
+    """
+
+    def __init__(
+        self, path: str, max_inline_chars: int = 4096, track_mutations: bool = True
+    ):
+        self.path = path
+        self.max_inline_chars = max_inline_chars
+        self.track_mutations = track_mutations
+        self.blobs_path = os.path.join(path, "blobs")
+        os.makedirs(self.blobs_path, exist_ok=True)
+        self.log_path = os.path.join(path, "log.jsonl")
+        self._repair_log()
+        # Per agent name: the steps already in the log, the blobs of the variables,
+        # the values they were pickled from, and the variables which can't be pickled
+        self._written_steps: dict[str, list[MemoryStep]] = {}
+        self._variable_hashes: dict[str, dict[str, str]] = {}
+        self._variable_values: dict[str, dict[str, Any]] = {}
+        self._skipped_variables: dict[str, list[str]] = {}
+        # Per agent name, the variables of the restored session which were not saved
+        self.missing_variables: dict[str, list[str]] = {}
+        self._agent_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def _repair_log(self) -> None:
+        """Cuts a last line left incomplete by a crash, so that records are not appended to it."""
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb+") as file:
+            end = file.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                chunk_size = min(4096, position)
+                file.seek(position - chunk_size)
+                newline_index = file.read(chunk_size).rfind(b"\n")
+                if newline_index >= 0:
+                    position += newline_index + 1 - chunk_size
+                    break
+                position -= chunk_size
+            if position < end:
+                file.truncate(position)
+
+    def attach(self, agent: MultiStepAgent, name: str | None = None) -> None:
+        """Checkpoints the agent and its managed agents, resuming their sessions if any."""
+        self._attach(agent, name or agent.name or "agent", self._read_log())
+
+    def _attach(
+        self, agent: MultiStepAgent, name: str, records: dict[str, list[dict]]
+    ) -> None:
+        self._agent_names[id(agent)] = name
+        agent.session_checkpoint = self
+        for managed_agent in agent.managed_agents.values():
+            self._attach(managed_agent, f"{name}/{managed_agent.name}", records)
+        self._restore(agent, name, records.get(name, []))
+
+    def _read_log(self) -> dict[str, list[dict]]:
+        """Returns the records of the log, by agent name."""
+        records: dict[str, list[dict]] = {}
+        if not os.path.exists(self.log_path):
+            return records
+        with open(self.log_path, encoding="utf-8") as file:
+            for line in file:
+                # The last line may be cut short by a crash
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records.setdefault(record["agent"], []).append(record)
+        return records
+
+    def _write_blob(self, data: bytes, extension: str) -> str:
+        blob_name = _blob_name(data, extension)
+        blob_path = os.path.join(self.blobs_path, blob_name)
+        if not os.path.exists(blob_path):
+            with open(f"{blob_path}.tmp", "wb") as file:
+                file.write(data)
+            os.replace(f"{blob_path}.tmp", blob_path)
+        return blob_name
+
+    def _append(self, records: list[dict]) -> None:
+        with open(self.log_path, "a", encoding="utf-8") as file:
+            file.write(
+                "".join(json.dumps(record, default=str) + "\n" for record in records)
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _step_record(self, step: MemoryStep) -> dict:
+        if isinstance(step, TaskStep):
+            return {"type": "task", "task": step.task}
+        if isinstance(step, PlanningStep):
+            return {
+                "type": "planning",
+                "plan": step.plan,
+                "model_output_message": _message_dict(step.model_output_message),
+                "timing": [step.timing.start_time, step.timing.end_time],
+                "token_usage": [
+                    step.token_usage.input_tokens,
+                    step.token_usage.output_tokens,
+                ]
+                if step.token_usage
+                else None,
+            }
+        record = {
+            "type": "action",
+            "step_number": step.step_number,
+            "timing": [step.timing.start_time, step.timing.end_time],
+            "tool_calls": [
+                [
+                    tool_call.name,
+                    make_json_serializable(tool_call.arguments),
+                    tool_call.id,
+                ]
+                for tool_call in step.tool_calls
+            ]
+            if step.tool_calls is not None
+            else None,
+            "error": step.error.dict() if step.error else None,
+            "model_output_message": _message_dict(step.model_output_message),
+            "code_action": step.code_action,
+            "token_usage": [
+                step.token_usage.input_tokens,
+                step.token_usage.output_tokens,
+            ]
+            if step.token_usage
+            else None,
+            "is_final_answer": step.is_final_answer,
+        }
+        if step.model_output != _message_content(step.model_output_message):
+            record["model_output"] = step.model_output
+        observations = step.observations
+        if observations is not None and len(observations) > self.max_inline_chars:
+            record["observations_blob"] = self._write_blob(
+                observations.encode("utf-8"), "txt"
+            )
+        else:
+            record["observations"] = observations
+        action_output = make_json_serializable(step.action_output)
+        serialized_action_output = json.dumps(action_output, default=str)
+        if len(serialized_action_output) > self.max_inline_chars:
+            record["action_output_blob"] = self._write_blob(
+                serialized_action_output.encode("utf-8"), "json"
+            )
+        else:
+            record["action_output"] = action_output
+        return record
+
+    def _variables_record(self, agent: MultiStepAgent, name: str) -> dict | None:
+        python_executor = getattr(agent, "python_executor", None)
+        if not isinstance(python_executor, LocalPythonExecutor):
+            return None
+        hashes = self._variable_hashes.setdefault(name, {})
+        values = self._variable_values.setdefault(name, {})
+        changed = {}
+        new_hashes = {}
+        new_values = {}
+        skipped = []
+        for variable, value in python_executor.state.items():
+            if variable in _EXECUTOR_INTERNAL_VARIABLES:
+                continue
+            if (
+                variable in hashes
+                and values.get(variable) is value
+                and (not self.track_mutations or isinstance(value, _IMMUTABLE_TYPES))
+            ):
+                new_hashes[variable] = hashes[variable]
+                new_values[variable] = value
+                continue
+            try:
+                data = pickle.dumps(value)
+            except Exception:
+                skipped.append(variable)
+                continue
+            new_hashes[variable] = _blob_name(data, "pkl")
+            new_values[variable] = value
+            if hashes.get(variable) != new_hashes[variable]:
+                changed[variable] = self._write_blob(data, "pkl")
+        removed = [variable for variable in hashes if variable not in new_hashes]
+        self._variable_hashes[name] = new_hashes
+        self._variable_values[name] = new_values
+        skipped_changed = skipped != self._skipped_variables.get(name, [])
+        self._skipped_variables[name] = skipped
+        if not changed and not removed and not skipped_changed:
+            return None
+        return {
+            "type": "variables",
+            "changed": changed,
+            "removed": removed,
+            "skipped": skipped,
+        }
+
+    def sync(
+        self, agent: MultiStepAgent, memory_step: MemoryStep | None = None
+    ) -> None:
+        """Appends the new steps of the agent, and ``memory_step`` if not in memory yet."""
+        name = self._agent_names.get(id(agent))
+        if name is None:
+            return
+        with self._lock:
+            steps = list(agent.memory.steps)
+            # Steps are compared by identity, as in IncrementalMessageBuilder
+            if memory_step is not None and not any(
+                step is memory_step for step in steps
+            ):
+                steps.append(memory_step)
+            written_steps = self._written_steps.setdefault(name, [])
+            records = []
+            first_new_step = 0
+            while (
+                first_new_step < min(len(written_steps), len(steps))
+                and written_steps[first_new_step] is steps[first_new_step]
+            ):
+                first_new_step += 1
+            if first_new_step < len(written_steps):
+                # The memory was reset: it is written again from the start
+                records.append({"type": "reset"})
+                first_new_step = 0
+            records.extend(self._step_record(step) for step in steps[first_new_step:])
+            variables_record = self._variables_record(agent, name)
+            if variables_record is not None:
+                records.append(variables_record)
+            if records:
+                self._append([{"agent": name, **record} for record in records])
+            self._written_steps[name] = steps
+
+    def _restore_step(self, record: dict) -> MemoryStep:
+        if record["type"] == "task":
+            return TaskStep(task=record["task"])
+        token_usage = (
+            TokenUsage(*record["token_usage"]) if record["token_usage"] else None
+        )
+        model_output_message = (
+            ChatMessage.from_dict(record["model_output_message"])
+            if record["model_output_message"]
+            else None
+        )
+        if record["type"] == "planning":
+            return PlanningStep(
+                model_input_messages=[],
+                model_output_message=model_output_message,
+                plan=record["plan"],
+                timing=Timing(*record["timing"]),
+                token_usage=token_usage,
+            )
+        error = None
+        if record["error"]:
+            error_class = getattr(smolagents, record["error"]["type"], None)
+            if error_class is None:
+                error_class = smolagents.AgentError
+            error = error_class(record["error"]["message"], _silent_logger)
+        step = LazyActionStep(
+            step_number=record["step_number"],
+            timing=Timing(*record["timing"]),
+            tool_calls=[ToolCall(*tool_call) for tool_call in record["tool_calls"]]
+            if record["tool_calls"] is not None
+            else None,
+            error=error,
+            model_output_message=model_output_message,
+            model_output=record.get(
+                "model_output", _message_content(model_output_message)
+            ),
+            code_action=record["code_action"],
+            observations=record.get("observations"),
+            action_output=record.get("action_output"),
+            token_usage=token_usage,
+            is_final_answer=record["is_final_answer"],
+        )
+        for field in ("observations", "action_output"):
+            if f"{field}_blob" in record:
+                step.__dict__[f"_{field}_path"] = os.path.join(
+                    self.blobs_path, record[f"{field}_blob"]
+                )
+        return step
+
+    def _restore(self, agent: MultiStepAgent, name: str, records: list[dict]) -> None:
+        if not records:
+            return
+        step_records: list[dict] = []
+        variables: dict[str, str] = {}
+        skipped: list[str] = []
+        for record in records:
+            if record["type"] == "reset":
+                step_records = []
+            elif record["type"] == "variables":
+                for variable in record["removed"]:
+                    variables.pop(variable, None)
+                variables.update(record["changed"])
+                skipped = record.get("skipped", [])
+            else:
+                step_records.append(record)
+        steps = [self._restore_step(record) for record in step_records]
+        agent.memory.steps = steps
+        self._written_steps[name] = list(steps)
+        python_executor = getattr(agent, "python_executor", None)
+        if isinstance(python_executor, LocalPythonExecutor) and variables:
+            restored_variables: dict[str, Any] = {}
+            for variable, blob_name in variables.items():
+                with open(os.path.join(self.blobs_path, blob_name), "rb") as file:
+                    restored_variables[variable] = pickle.load(file)
+            python_executor.state.update(restored_variables)
+            self._variable_hashes[name] = variables
+            self._variable_values[name] = restored_variables
+        if skipped:
+            self.missing_variables[name] = skipped
+            self._skipped_variables[name] = skipped
+            agent.logger.log(
+                f"Variables of {name} which could not be restored: {', '.join(skipped)}",
+                level=LogLevel.INFO,
+            )
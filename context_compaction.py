@@ -0,0 +1,137 @@
+import weakref
+from collections.abc import Callable
+from dataclasses import replace
+
+from smolagents import ActionStep, ChatMessage, MemoryStep
+
+from message_builder import IncrementalMessageBuilder
+from token_counting import count_tokens
+
+COMPACTION_STRATEGIES = ("truncate", "drop", "summarize")
+DROPPED_OBSERVATION = "[Observation dropped to save context]"
+
+
+def count_message_tokens(messages: list[ChatMessage]) -> int:
+    total = 0
+    for message in messages:
+        if isinstance(message.content, str):
+            total += count_tokens(message.content)
+        elif isinstance(message.content, list):
+            total += sum(count_tokens(e.get("text", "")) for e in message.content)
+    return total
+
+
+class _PerStepCache:
+    """Values computed for memory steps, released when the steps are garbage collected."""
+
+    def __init__(self):
+        self._values: dict[int, object] = {}
+
+    def get(self, step: MemoryStep, compute: Callable[[], object]):
+        key = id(step)
+        if key not in self._values:
+            self._values[key] = compute()
+            weakref.finalize(step, self._values.pop, key, None)
+        return self._values[key]
+
+
+class ContextCompactor:
+    """Keeps the input messages of an agent within a token budget.
+
+    Tokens are counted locally with tiktoken (see `count_tokens`), so the budget is
+    approximate. When the messages built from memory exceed ``max_input_tokens``,
+    the observations of the oldest action steps are compacted, one step at a time,
+    until the messages fit. The last ``keep_last_steps`` action steps are never
+    compacted. Memory itself is left untouched, only the messages sent to the
+    model are compacted.
+
+    Strategies:
+    - "truncate": keep the first ``truncated_observation_chars`` characters.
+    - "drop": replace the observations with a placeholder.
+    - "summarize": replace the observations with ``summarize(observations)``.
+    """
+
+    def __init__(
+        self,
+        max_input_tokens: int,
+        strategy: str = "truncate",
+        keep_last_steps: int = 2,
+        truncated_observation_chars: int = 500,
+        summarize: Callable[[str], str] | None = None,
+    ):
+        if strategy not in COMPACTION_STRATEGIES:
+            raise ValueError(
+                f"Unknown compaction strategy {strategy}, should be one of {COMPACTION_STRATEGIES}"
+            )
+        if strategy == "summarize" and summarize is None:
+            raise ValueError("The summarize strategy needs a summarize function")
+        self.max_input_tokens = max_input_tokens
+        self.strategy = strategy
+        self.keep_last_steps = keep_last_steps
+        self.truncated_observation_chars = truncated_observation_chars
+        self.summarize = summarize
+        self._token_counts = _PerStepCache()
+        self._compacted_messages = _PerStepCache()
+        self._compacted_token_counts = _PerStepCache()
+
+    def _compact_observations(self, observations: str) -> str:
+        if self.strategy == "truncate":
+            if len(observations) <= self.truncated_observation_chars:
+                return observations
+            return (
+                observations[: self.truncated_observation_chars]
+                + f"\n[... {len(observations) - self.truncated_observation_chars} characters truncated to save context]"
+            )
+        if self.strategy == "drop":
+            return DROPPED_OBSERVATION
+        return self.summarize(observations)
+
+    def _get_compacted_messages(self, step: ActionStep) -> list[ChatMessage]:
+        return self._compacted_messages.get(
+            step,
+            lambda: replace(
+                step, observations=self._compact_observations(step.observations)
+            ).to_messages(),
+        )
+
+    def compact(
+        self, message_builder: IncrementalMessageBuilder
+    ) -> tuple[list[ChatMessage], int]:
+        """Returns the compacted messages of the last build, and the number of tokens saved."""
+        steps_messages = [
+            [step, messages] for step, messages in message_builder.iter_step_messages()
+        ]
+        token_counts = [
+            self._token_counts.get(step, lambda: count_message_tokens(messages))
+            for step, messages in steps_messages
+        ]
+        total_tokens = count_message_tokens(message_builder.system_messages) + sum(
+            token_counts
+        )
+        saved_tokens = 0
+        if total_tokens > self.max_input_tokens:
+            action_step_indices = [
+                index
+                for index, (step, _) in enumerate(steps_messages)
+                if isinstance(step, ActionStep)
+            ]
+            compactable_indices = action_step_indices[
+                : max(0, len(action_step_indices) - self.keep_last_steps)
+            ]
+            for index in compactable_indices:
+                step = steps_messages[index][0]
+                if not step.observations:
+                    continue
+                compacted_messages = self._get_compacted_messages(step)
+                compacted_token_count = self._compacted_token_counts.get(
+                    step, lambda: count_message_tokens(compacted_messages)
+                )
+                saved_tokens += token_counts[index] - compacted_token_count
+                steps_messages[index][1] = compacted_messages
+                if total_tokens - saved_tokens <= self.max_input_tokens:
+                    break
+
+        messages = list(message_builder.system_messages)
+        for _, step_messages in steps_messages:
+            messages.extend(step_messages)
+        return messages, saved_tokens
@@ -0,0 +1,119 @@
+import json
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+from smolagents import ActionStep, AgentMaxStepsError, MultiStepAgent
+
+
+def normalize_task(task: str) -> str:
+    # Nearly identical tasks only differ by case, spacing or final punctuation
+    return re.sub(r"\s+", " ", task).strip().rstrip(".!?").strip().casefold()
+
+
+def summarize_run(agent: MultiStepAgent, max_action_length: int = 80) -> str:
+    """Returns a one line summary of the actions of the last run of an agent."""
+    actions = []
+    steps = [step for step in agent.memory.steps if isinstance(step, ActionStep)]
+    for step in steps:
+        for tool_call in step.tool_calls or []:
+            arguments = " ".join(str(tool_call.arguments).split())
+            if len(arguments) > max_action_length:
+                arguments = arguments[:max_action_length] + "..."
+            actions.append(f"{tool_call.name}({arguments})")
+    return f"{len(steps)} steps: {'; '.join(actions) or 'no actions'}"
+
+
+@dataclass
+class DelegationCacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Calls which can't be cached, e.g. with images
+    bypassed: int = 0
+
+    def dict(self):
+        return asdict(self)
+
+
+@dataclass
+class CachedDelegation:
+    answer: str
+    summary: str
+    created_at: float
+
+
+class DelegationCache:
+    """Memoizes the delegations of a manager agent to its managed agents.
+
+    Delegations are keyed by the name of the managed agent, the normalized task
+    and the additional args. A repeated delegation returns the earlier answer with
+    a short summary of its run, instead of running the managed agent again.
+
+    Entries expire after ``ttl`` seconds, and only last for the session of the
+    manager: a run of the manager with reset=True starts a new session, while
+    runs with reset=False continue it. Runs which hit their maximum number of
+    steps are not cached, as the manager may delegate again to recover.
+    """
+
+    def __init__(self, ttl: float | None = 600.0):
+        self.ttl = ttl
+        self.stats = DelegationCacheStats()
+        self.owner: MultiStepAgent | None = None
+        self._entries: dict[tuple, CachedDelegation] = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def attach(self, owner: MultiStepAgent) -> None:
+        """Caches the delegations of the owner to its managed agents."""
+        self.owner = owner
+        for managed_agent in owner.managed_agents.values():
+            managed_agent.manager_delegation_cache = self
+
+    def key(self, agent_name: str, task: str, kwargs: dict) -> tuple | None:
+        if set(kwargs) - {"additional_args"}:
+            return None
+        # Missing additional args are the same as empty ones
+        additional_args = json.dumps(
+            kwargs.get("additional_args") or {}, sort_keys=True, default=repr
+        )
+        return agent_name, normalize_task(task), additional_args
+
+    def _check_session(self) -> None:
+        # The first step of the memory of the owner is replaced by each reset
+        session = self.owner.memory.steps[0] if self.owner.memory.steps else None
+        if session is not self._session:
+            self._session = session
+            self._entries.clear()
+
+    def get(self, key: tuple | None) -> str | None:
+        with self._lock:
+            if key is None:
+                self.stats.bypassed += 1
+                return None
+            self._check_session()
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.time() - entry.created_at <= self.ttl
+            ):
+                self.stats.hits += 1
+                return (
+                    f"{entry.answer}\n\n(This is the answer of {key[0]} to the same task, "
+                    f"delegated {time.time() - entry.created_at:.0f}s ago, which is not run "
+                    f"again. That run took {entry.summary})"
+                )
+            self._entries.pop(key, None)
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: tuple | None, agent: MultiStepAgent, answer: str) -> None:
+        if key is None:
+            return
+        last_step = agent.memory.steps[-1] if agent.memory.steps else None
+        if isinstance(getattr(last_step, "error", None), AgentMaxStepsError):
+            return
+        with self._lock:
+            self._check_session()
+            self._entries[key] = CachedDelegation(
+                answer=answer, summary=summarize_run(agent), created_at=time.time()
+            )
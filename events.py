@@ -0,0 +1,203 @@
+import dataclasses
+import json
+import queue
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from rich.console import Group
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.text import Text
+from smolagents import AgentLogger, LogLevel
+
+from streaming import RenderThrottle, StreamAccumulator
+
+EVENT_TYPES = (
+    # A chunk of the model output, as a ChatMessageStreamDelta
+    "delta",
+    # The whole model output, once generated
+    "model_output",
+    # The code about to be run by a code agent
+    "code",
+    # A tool about to be called by a tool calling agent
+    "tool_call",
+    "observation",
+    "final_answer",
+    "error",
+    "stats",
+    # The exported messages of the agent tree, when the stats are dumped
+    "transcript",
+    # The result of a job run by the worker service
+    "result",
+)
+
+
+def _to_serializable(value: Any) -> Any:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    return value
+
+
+@dataclass
+class AgentEvent:
+    type: str
+    agent_name: str | None
+    step_number: int | None
+    data: dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+    def dict(self):
+        return {
+            "type": self.type,
+            "agent_name": self.agent_name,
+            "step_number": self.step_number,
+            "data": {key: _to_serializable(value) for key, value in self.data.items()},
+            "timestamp": self.timestamp,
+        }
+
+
+class EventSink:
+    """Receives the events of agents, instead of rendering them to the console."""
+
+    def emit(self, event: AgentEvent) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CallbackSink(EventSink):
+    def __init__(self, callback: Callable[[AgentEvent], None]):
+        self.callback = callback
+
+    def emit(self, event: AgentEvent) -> None:
+        self.callback(event)
+
+
+class QueueSink(EventSink):
+    """Puts the events in a queue, e.g. to consume them from another thread."""
+
+    def __init__(self, event_queue: queue.Queue | None = None):
+        self.queue = event_queue if event_queue is not None else queue.Queue()
+
+    def emit(self, event: AgentEvent) -> None:
+        self.queue.put(event)
+
+
+class JSONLSink(EventSink):
+    """Appends the events to a JSONL file, one line per event."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, event: AgentEvent) -> None:
+        line = json.dumps(event.dict(), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            # Deltas are only flushed with the next events
+            if event.type != "delta":
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class ConsoleSink(EventSink):
+    """Renders the events to the console of an agent logger, with rich.
+
+    Streamed outputs are rendered live, throttled (see `RenderThrottle`).
+    """
+
+    def __init__(
+        self,
+        logger: AgentLogger,
+        render_interval: float = 0.1,
+        max_pending_chars: int | None = None,
+    ):
+        self.logger = logger
+        self.render_interval = render_interval
+        self.max_pending_chars = max_pending_chars
+        self._live: Live | None = None
+        self._stream_accumulator: StreamAccumulator | None = None
+        self._render_throttle: RenderThrottle | None = None
+
+    def _render_delta(self, event: AgentEvent) -> None:
+        if self._live is None:
+            self._live = Live(
+                "", console=self.logger.console, vertical_overflow="visible"
+            )
+            self._live.start()
+            self._stream_accumulator = StreamAccumulator()
+            self._render_throttle = RenderThrottle(
+                interval=self.render_interval, max_pending_chars=self.max_pending_chars
+            )
+        delta = event.data["delta"]
+        self._stream_accumulator.add(delta)
+        if self._render_throttle.should_render(len(delta.content or "")):
+            self._live.update(Markdown(self._stream_accumulator.render_as_markdown()))
+
+    def _stop_live(self) -> None:
+        if self._live is not None:
+            self._live.update(Markdown(self._stream_accumulator.render_as_markdown()))
+            self._live.stop()
+            self._live = None
+
+    def emit(self, event: AgentEvent) -> None:
+        if event.type == "delta":
+            self._render_delta(event)
+            return
+        self._stop_live()
+        if event.type == "model_output" and not event.data["streamed"]:
+            self.logger.log_markdown(
+                content=event.data["content"],
+                title="Output message of the LLM:",
+                level=LogLevel.DEBUG,
+            )
+        elif event.type == "code":
+            self.logger.log_code(
+                title="Executing parsed code:",
+                content=event.data["code"],
+                level=LogLevel.INFO,
+            )
+        elif event.type == "tool_call":
+            self.logger.log(
+                Panel(
+                    Text(
+                        f"Calling tool: '{event.data['name']}' with arguments: {event.data['arguments']}"
+                    ),
+                    # Tells apart the tool calls of the managed agents
+                    title=event.agent_name,
+                ),
+                level=LogLevel.INFO,
+            )
+        elif event.type == "observation" and "logs" in event.data:
+            execution_outputs_console = []
+            if len(event.data["logs"]) > 0:
+                execution_outputs_console += [
+                    Text("Execution logs:", style="bold"),
+                    Text(event.data["logs"]),
+                ]
+            if event.data["output"] is not None:
+                execution_outputs_console.append(Text(f"Out: {event.data['output']}"))
+            if execution_outputs_console:
+                self.logger.log(Group(*execution_outputs_console), level=LogLevel.INFO)
+        elif event.type == "observation":
+            self.logger.log(
+                f"Observations: {event.data['observation'].replace('[', '|')}",
+                level=LogLevel.INFO,
+            )
+        elif event.type == "error":
+            error_msg = event.data["error"]
+            if "Import of " in error_msg and " is not allowed" in error_msg:
+                self.logger.log(
+                    "[bold red]Warning to user: Code execution failed due to an unauthorized import - Consider passing said import under `additional_authorized_imports` when initializing your CodeAgent.",
+                    level=LogLevel.INFO,
+                )
+        # The other events are already logged by the agents (e.g. the final answer)
@@ -0,0 +1,169 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any
+
+_WHITESPACE = " \t\n\r"
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+_NUMBER_PATTERN = re.compile(r"-?\d+(\.\d*)?([eE][+-]?\d*)?")
+
+
+@dataclass
+class ParsingRecoveryStats:
+    """Outputs which failed to parse as JSON, and how they were recovered."""
+
+    failures: int = 0
+    recoveries: dict[str, int] = field(default_factory=dict)
+
+    def count_recovery(self, strategy: str) -> None:
+        self.recoveries[strategy] = self.recoveries.get(strategy, 0) + 1
+
+    def dict(self):
+        return {
+            "recoveries": sum(self.recoveries.values()),
+            "failures": self.failures,
+            "recoveries_by_strategy": dict(self.recoveries),
+        }
+
+
+class _PartialJSONParser:
+    """Lenient JSON parser for the truncated or slightly malformed outputs of LLMs.
+
+    - Raw control characters (e.g. newlines) are accepted in strings.
+    - Invalid escapes (e.g. ``\\d`` in a regex) are kept as they are.
+    - At the end of the text, open strings, arrays and objects are closed, and a
+    key without a value is dropped.
+    - Text after the top-level value is ignored.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.index = 0
+
+    def parse(self) -> Any:
+        self._skip_whitespace()
+        if self.index >= len(self.text):
+            raise ValueError("No JSON value found")
+        return self._parse_value()
+
+    def _at_end(self) -> bool:
+        self._skip_whitespace()
+        return self.index >= len(self.text)
+
+    def _skip_whitespace(self) -> None:
+        while self.index < len(self.text) and self.text[self.index] in _WHITESPACE:
+            self.index += 1
+
+    def _parse_value(self) -> Any:
+        char = self.text[self.index]
+        if char == "{":
+            return self._parse_object()
+        if char == "[":
+            return self._parse_array()
+        if char == '"':
+            return self._parse_string()
+        for literal, value in (("true", True), ("false", False), ("null", None)):
+            # A truncated literal is completed
+            if literal.startswith(self.text[self.index : self.index + len(literal)]):
+                self.index += len(literal)
+                return value
+        match = _NUMBER_PATTERN.match(self.text, self.index)
+        if match:
+            self.index = match.end()
+            number = match.group().rstrip(".eE+-")
+            return float(number) if any(c in number for c in ".eE") else int(number)
+        raise ValueError(f"Unexpected character {char!r} at position {self.index}")
+
+    def _parse_object(self) -> dict:
+        result = {}
+        self.index += 1
+        while not self._at_end():
+            if self.text[self.index] == "}":
+                self.index += 1
+                return result
+            if self.text[self.index] == ",":
+                self.index += 1
+                continue
+            key = self._parse_string()
+            if self._at_end():
+                break
+            if self.text[self.index] != ":":
+                raise ValueError(f"Expected ':' at position {self.index}")
+            self.index += 1
+            if self._at_end():
+                break
+            result[key] = self._parse_value()
+        return result
+
+    def _parse_array(self) -> list:
+        result = []
+        self.index += 1
+        while not self._at_end():
+            if self.text[self.index] == "]":
+                self.index += 1
+                return result
+            if self.text[self.index] == ",":
+                self.index += 1
+                continue
+            result.append(self._parse_value())
+        return result
+
+    def _parse_string(self) -> str:
+        if self.text[self.index] != '"':
+            raise ValueError(f"Expected '\"' at position {self.index}")
+        self.index += 1
+        chars = []
+        while self.index < len(self.text):
+            char = self.text[self.index]
+            if char == '"':
+                self.index += 1
+                return "".join(chars)
+            if char == "\\" and self.index + 1 < len(self.text):
+                escape = self.text[self.index + 1]
+                if escape in _ESCAPES:
+                    chars.append(_ESCAPES[escape])
+                    self.index += 2
+                    continue
+                if escape == "u":
+                    code_point = self.text[self.index + 2 : self.index + 6]
+                    if len(code_point) == 4 and all(
+                        c in "0123456789abcdefABCDEF" for c in code_point
+                    ):
+                        chars.append(chr(int(code_point, 16)))
+                        self.index += 6
+                        continue
+            elif char == "\\":
+                # Truncated in the middle of an escape
+                self.index += 1
+                break
+            chars.append(char)
+            self.index += 1
+        return "".join(chars)
+
+
+def repair_json(text: str) -> tuple[Any, str]:
+    """Parses text which failed to parse as JSON.
+
+    Returns the parsed value and the name of the strategy which recovered it,
+    raises ValueError if none did.
+    """
+    text = text.strip()
+    try:
+        return json.JSONDecoder().raw_decode(text)[0], "trailing_text"
+    except ValueError:
+        pass
+    try:
+        # Not strict: raw control characters (e.g. newlines) are allowed in strings
+        return json.JSONDecoder(strict=False).raw_decode(text)[0], "control_characters"
+    except ValueError:
+        pass
+    return _PartialJSONParser(text).parse(), "partial_json"
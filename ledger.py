@@ -0,0 +1,235 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, fields
+
+from smolagents import ActionStep, MemoryStep, MultiStepAgent
+
+PERCENTILES = (50, 95)
+# Guards the totals, which the steps of managed agents running in parallel (e.g.
+# parallel tool calls) update up the same chain of ledgers
+_totals_lock = threading.Lock()
+# Timer of the step being run in the current thread, see current_step_timer
+_current_step_timer: ContextVar["StepTimer | None"] = ContextVar(
+    "current_step_timer", default=None
+)
+
+
+@dataclass
+class StepTimer:
+    """Collects the timings of the phases of the step being run."""
+
+    start_time: float
+    time_to_first_token: float | None = None
+    generation_time: float = 0.0
+    parse_time: float = 0.0
+    executor_time: float = 0.0
+    # Input tokens saved by context compaction
+    compacted_tokens: int = 0
+    # Model requests retried after transient errors, see ResilientModel
+    retries: int = 0
+
+    def mark_first_token(self, generation_start_time: float) -> None:
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.time() - generation_start_time
+
+    @contextmanager
+    def measure(self, phase: str):
+        phase_start_time = time.time()
+        try:
+            yield
+        finally:
+            setattr(self, phase, getattr(self, phase) + time.time() - phase_start_time)
+
+
+@dataclass
+class StepRecord:
+    agent_name: str
+    step_number: int | None
+    step_type: str
+    duration: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    time_to_first_token: float | None = None
+    generation_time: float = 0.0
+    parse_time: float = 0.0
+    executor_time: float = 0.0
+    compacted_tokens: int = 0
+    retries: int = 0
+    # An error in a step makes the agent try again in the next step
+    errors: int = 0
+
+
+@dataclass
+class LedgerTotals:
+    steps: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    duration: float = 0.0
+    generation_time: float = 0.0
+    parse_time: float = 0.0
+    executor_time: float = 0.0
+    compacted_tokens: int = 0
+    retries: int = 0
+    errors: int = 0
+
+    def add(self, other: "StepRecord | LedgerTotals") -> None:
+        self.steps += other.steps if isinstance(other, LedgerTotals) else 1
+        for field in fields(self):
+            if field.name != "steps":
+                setattr(
+                    self,
+                    field.name,
+                    getattr(self, field.name) + getattr(other, field.name),
+                )
+
+
+def _percentile(values: list[float], percentile: int) -> float | None:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, -(-percentile * len(values) // 100) - 1)
+    return values[rank]
+
+
+class AgentLedger:
+    """Per step timings and token usage of an agent.
+
+    Totals are updated as steps are recorded, both for the agent itself and up the
+    chain of its managers, so reading the totals of a whole agent tree is O(1).
+    The ledger covers every run of the agent, including the runs of managed agents
+    which are reset at each delegation.
+    """
+
+    def __init__(self, agent_name: str):
+        self.agent_name = agent_name
+        self.records: list[StepRecord] = []
+        self.totals = LedgerTotals()
+        self.tree_totals = LedgerTotals()
+        self.parent: AgentLedger | None = None
+        self.children: list[AgentLedger] = []
+        self.current_step_timer: StepTimer | None = None
+        self._outer_step_timer: StepTimer | None = None
+
+    def attach(self, parent: "AgentLedger") -> None:
+        with _totals_lock:
+            self.parent = parent
+            parent.children.append(self)
+            ledger = parent
+            while ledger is not None:
+                ledger.tree_totals.add(self.tree_totals)
+                ledger = ledger.parent
+
+    def start_step(self) -> StepTimer:
+        self.current_step_timer = StepTimer(start_time=time.time())
+        # The step of a manager resumes once the managed agent it called is done
+        self._outer_step_timer = _current_step_timer.get()
+        _current_step_timer.set(self.current_step_timer)
+        return self.current_step_timer
+
+    def record_step(self, memory_step: MemoryStep) -> StepRecord:
+        step_timer = self.current_step_timer or StepTimer(start_time=time.time())
+        self.current_step_timer = None
+        _current_step_timer.set(self._outer_step_timer)
+        self._outer_step_timer = None
+        token_usage = getattr(memory_step, "token_usage", None)
+        timing = getattr(memory_step, "timing", None)
+        record = StepRecord(
+            agent_name=self.agent_name,
+            step_number=getattr(memory_step, "step_number", None),
+            step_type=type(memory_step).__name__,
+            duration=(timing.duration or 0.0) if timing else 0.0,
+            input_tokens=token_usage.input_tokens if token_usage else 0,
+            output_tokens=token_usage.output_tokens if token_usage else 0,
+            time_to_first_token=step_timer.time_to_first_token,
+            generation_time=step_timer.generation_time,
+            parse_time=step_timer.parse_time,
+            executor_time=step_timer.executor_time,
+            compacted_tokens=step_timer.compacted_tokens,
+            retries=step_timer.retries,
+            errors=int(
+                isinstance(memory_step, ActionStep) and memory_step.error is not None
+            ),
+        )
+        with _totals_lock:
+            self.records.append(record)
+            self.totals.add(record)
+            ledger = self
+            while ledger is not None:
+                ledger.tree_totals.add(record)
+                ledger = ledger.parent
+        return record
+
+    def iter_records(self):
+        yield from self.records
+        for child in self.children:
+            yield from child.iter_records()
+
+    def summary(self) -> dict:
+        records = list(self.iter_records())
+        summary = {
+            "agent": self.agent_name,
+            "totals": asdict(self.totals),
+            "tree_totals": asdict(self.tree_totals),
+            "agents": {},
+            "percentiles": {},
+            # Steps whose input messages were compacted (see ContextCompactor)
+            "compactions": [
+                {
+                    "agent": record.agent_name,
+                    "step_number": record.step_number,
+                    "compacted_tokens": record.compacted_tokens,
+                }
+                for record in records
+                if record.compacted_tokens
+            ],
+        }
+        for record in records:
+            agent_totals = summary["agents"].setdefault(
+                record.agent_name, LedgerTotals()
+            )
+            agent_totals.add(record)
+        summary["agents"] = {
+            agent_name: asdict(totals)
+            for agent_name, totals in summary["agents"].items()
+        }
+        for metric in (
+            "duration",
+            "time_to_first_token",
+            "generation_time",
+            "parse_time",
+            "executor_time",
+            "compacted_tokens",
+            "input_tokens",
+            "output_tokens",
+        ):
+            values = [
+                getattr(record, metric)
+                for record in records
+                if getattr(record, metric) is not None
+            ]
+            summary["percentiles"][metric] = {
+                f"p{percentile}": _percentile(values, percentile)
+                for percentile in PERCENTILES
+            }
+        return summary
+
+
+def current_step_timer() -> StepTimer | None:
+    """Returns the timer of the step being run in the current thread, if any.
+
+    Lets code without access to the agent, e.g. models, account to its step.
+    """
+    return _current_step_timer.get()
+
+
+def setup_ledger(agent: MultiStepAgent) -> AgentLedger:
+    """Creates the ledger of an agent and attaches the ledgers of its managed agents."""
+    agent.ledger = AgentLedger(agent.name if agent.name else "unnamed_agent")
+    for managed_agent in agent.managed_agents.values():
+        managed_ledger = getattr(managed_agent, "ledger", None)
+        if managed_ledger is not None:
+            managed_ledger.attach(agent.ledger)
+    return agent.ledger
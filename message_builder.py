@@ -0,0 +1,62 @@
+from collections.abc import Iterator
+
+from smolagents import AgentMemory, ChatMessage, MemoryStep
+
+
+class IncrementalMessageBuilder:
+    """Builds the input messages of an agent from its memory, incrementally.
+
+    Steps are finished (and no longer modified) once they are in memory, so their
+    rendered messages are cached and only the new steps are rendered at each call.
+    The cache is matched against the memory by step identity, so resetting or
+    editing the memory invalidates the cache from the first differing step.
+    """
+
+    def __init__(self):
+        self._system_prompt: str | None = None
+        self._system_messages_count = 0
+        self._steps: list[MemoryStep] = []
+        # Number of messages up to the end of each step, system prompt included
+        self._step_message_ends: list[int] = []
+        self._messages: list[ChatMessage] = []
+
+    def build(self, memory: AgentMemory) -> list[ChatMessage]:
+        if memory.system_prompt.system_prompt != self._system_prompt:
+            self._system_prompt = memory.system_prompt.system_prompt
+            self._steps = []
+            self._step_message_ends = []
+            self._messages = memory.system_prompt.to_messages()
+            self._system_messages_count = len(self._messages)
+
+        first_new_step = 0
+        while (
+            first_new_step < min(len(self._steps), len(memory.steps))
+            and self._steps[first_new_step] is memory.steps[first_new_step]
+        ):
+            first_new_step += 1
+        if first_new_step < len(self._steps):
+            end = (
+                self._step_message_ends[first_new_step - 1]
+                if first_new_step > 0
+                else self._system_messages_count
+            )
+            del self._steps[first_new_step:]
+            del self._step_message_ends[first_new_step:]
+            del self._messages[end:]
+
+        for step in memory.steps[first_new_step:]:
+            self._messages.extend(step.to_messages())
+            self._steps.append(step)
+            self._step_message_ends.append(len(self._messages))
+        return list(self._messages)
+
+    @property
+    def system_messages(self) -> list[ChatMessage]:
+        return self._messages[: self._system_messages_count]
+
+    def iter_step_messages(self) -> Iterator[tuple[MemoryStep, list[ChatMessage]]]:
+        """Yields each step of the last build with its messages."""
+        start = self._system_messages_count
+        for step, end in zip(self._steps, self._step_message_ends):
+            yield step, self._messages[start:end]
+            start = end
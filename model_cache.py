@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Generator
+from dataclasses import dataclass
+from typing import Any
+
+from smolagents import (
+    ChatMessage,
+    ChatMessageStreamDelta,
+    MessageRole,
+    Model,
+    TokenUsage,
+    Tool,
+)
+from smolagents.models import (
+    ChatMessageToolCallFunction,
+    ChatMessageToolCallStreamDelta,
+)
+
+from streaming import StreamAccumulator
+
+CACHE_MODES = ("record", "replay")
+
+
+class CacheMissError(Exception):
+    pass
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def dict(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def _message_to_dict(message: ChatMessage | dict) -> dict:
+    if isinstance(message, ChatMessage):
+        message = message.dict()
+    return {key: value for key, value in message.items() if key != "raw"}
+
+
+def get_cache_key(
+    model_id: str,
+    messages: list[ChatMessage | dict],
+    stop_sequences: list[str] | None = None,
+    response_format: dict[str, str] | None = None,
+    tools_to_call_from: list[Tool] | None = None,
+) -> str:
+    payload = {
+        "model_id": model_id,
+        "messages": [_message_to_dict(message) for message in messages],
+        "stop_sequences": stop_sequences,
+        "response_format": response_format,
+        "tools": sorted(tool.name for tool in tools_to_call_from or []),
+    }
+    serialized = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class CacheIndex:
+    """Least recently used entries of a cache directory, and the lock guarding them."""
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Least recently used entries first
+        entries = [
+            (os.path.getmtime(os.path.join(cache_dir, file_name)), file_name[:-5])
+            for file_name in os.listdir(cache_dir)
+            if file_name.endswith(".json")
+        ]
+        self.entries: OrderedDict[str, None] = OrderedDict(
+            (key, None) for _, key in sorted(entries)
+        )
+        self.lock = threading.Lock()
+
+
+_cache_indexes: dict[str, CacheIndex] = {}
+_cache_indexes_lock = threading.Lock()
+
+
+def get_cache_index(cache_dir: str) -> CacheIndex:
+    """Returns the index of a cache directory, shared by all the models caching in it."""
+    cache_dir = os.path.realpath(cache_dir)
+    with _cache_indexes_lock:
+        if cache_dir not in _cache_indexes:
+            _cache_indexes[cache_dir] = CacheIndex(cache_dir)
+        return _cache_indexes[cache_dir]
+
+
+class CachedModel(Model):
+    """Caches the responses of a model on disk.
+
+    Entries are keyed on a hash of the request, so streamed and non-streamed calls
+    with the same request share their entry. At most ``max_entries`` entries are
+    kept, evicting the least recently used ones, and entries older than ``ttl``
+    seconds are ignored.
+
+    Modes:
+    - "record": serve hits from the cache and store misses.
+    - "replay": serve hits from the cache and raise a CacheMissError on misses, to
+    run recorded sessions offline and deterministically.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        cache_dir: str,
+        mode: str = "record",
+        max_entries: int | None = 1000,
+        ttl: float | None = None,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode {mode}, should be one of {CACHE_MODES}"
+            )
+        super().__init__(model_id=model.model_id)
+        self.model = model
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_stats = CacheStats()
+        # Models caching in the same directory evict from the same index
+        cache_index = get_cache_index(cache_dir)
+        self._index = cache_index.entries
+        self._lock = cache_index.lock
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose the attributes of the wrapped model, e.g. its stats
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key: str) -> ChatMessage | None:
+        with self._lock:
+            if key not in self._index:
+                return None
+            path = self._entry_path(key)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                self._index.pop(key, None)
+                return None
+            if self.ttl is not None and time.time() - entry["created_at"] > self.ttl:
+                self._index.pop(key, None)
+                os.remove(path)
+                self.cache_stats.evictions += 1
+                return None
+            self._index.move_to_end(key)
+            os.utime(path)
+        message = entry["message"]
+        message["role"] = MessageRole(message["role"])
+        return ChatMessage.from_dict(
+            message,
+            token_usage=TokenUsage(**message["token_usage"])
+            if message.get("token_usage")
+            else None,
+        )
+
+    def _store(self, key: str, chat_message: ChatMessage) -> None:
+        message = chat_message.dict()
+        message.pop("raw", None)
+        if message.get("token_usage"):
+            message["token_usage"] = {
+                "input_tokens": chat_message.token_usage.input_tokens,
+                "output_tokens": chat_message.token_usage.output_tokens,
+            }
+        entry = {
+            "created_at": time.time(),
+            "model_id": self.model_id,
+            "message": message,
+        }
+        with self._lock:
+            path = self._entry_path(key)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(entry, file, default=str)
+            os.replace(f"{path}.tmp", path)
+            self._index[key] = None
+            self._index.move_to_end(key)
+            while self.max_entries is not None and len(self._index) > self.max_entries:
+                evicted_key, _ = self._index.popitem(last=False)
+                try:
+                    os.remove(self._entry_path(evicted_key))
+                except FileNotFoundError:
+                    pass
+                self.cache_stats.evictions += 1
+
+    def _lookup(self, key: str) -> ChatMessage | None:
+        chat_message = self._load(key)
+        if chat_message is not None:
+            self.cache_stats.hits += 1
+            return chat_message
+        self.cache_stats.misses += 1
+        if self.mode == "replay":
+            raise CacheMissError(
+                f"No cached response for model {self.model_id} (key {key}) in replay mode"
+            )
+        return None
+
+    def generate(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> ChatMessage:
+        key = get_cache_key(
+            self.model_id, messages, stop_sequences, response_format, tools_to_call_from
+        )
+        chat_message = self._lookup(key)
+        if chat_message is None:
+            chat_message = self.model.generate(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            )
+            self._store(key, chat_message)
+        return chat_message
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        key = get_cache_key(
+            self.model_id, messages, stop_sequences, response_format, tools_to_call_from
+        )
+        chat_message = self._lookup(key)
+        if chat_message is not None:
+            yield ChatMessageStreamDelta(
+                content=chat_message.content,
+                tool_calls=[
+                    ChatMessageToolCallStreamDelta(
+                        index=index,
+                        id=tool_call.id,
+                        type=tool_call.type,
+                        function=ChatMessageToolCallFunction(
+                            name=tool_call.function.name,
+                            arguments=tool_call.function.arguments,
+                        ),
+                    )
+                    for index, tool_call in enumerate(chat_message.tool_calls)
+                ]
+                if chat_message.tool_calls
+                else None,
+                token_usage=chat_message.token_usage,
+            )
+            return
+
+        stream_accumulator = StreamAccumulator(role=MessageRole.ASSISTANT)
+        for event in self.model.generate_stream(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        ):
+            stream_accumulator.add(event)
+            yield event
+        # Only complete streams are stored
+        self._store(key, stream_accumulator.to_chat_message())
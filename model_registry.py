@@ -0,0 +1,95 @@
+import importlib.util
+import threading
+
+import httpx
+import openai
+
+from poe_models import PoeServerModel
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ModelRegistry:
+    """Process-wide registry of models, keyed by (model_id, base_url).
+
+    Agents asking for the same model share the same model instance, and all the
+    models share a single pooled HTTP client, so warm keep-alive connections (and
+    their TLS sessions) are reused across agents, instead of each model opening
+    its own connection pool. The stats of a model (e.g. its stop sequence stats)
+    are shared as well.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = HTTP2_AVAILABLE,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self._http_client: httpx.Client | None = None
+        self._models: dict[tuple[str, str], PoeServerModel] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **kwargs) -> None:
+        """Changes the limits of the HTTP client, before any model is created."""
+        with self._lock:
+            if self._http_client is not None:
+                raise RuntimeError("The HTTP client is already in use")
+            for name, value in kwargs.items():
+                if name not in (
+                    "max_connections",
+                    "max_keepalive_connections",
+                    "keepalive_expiry",
+                    "http2",
+                ):
+                    raise ValueError(f"Unknown HTTP client option {name}")
+                setattr(self, name, value)
+
+    @property
+    def http_client(self) -> httpx.Client:
+        with self._lock:
+            return self._get_http_client()
+
+    def _get_http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            # With the defaults of the openai client (timeouts, redirects)
+            self._http_client = openai.DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                http2=self.http2,
+            )
+        return self._http_client
+
+    def get(self, model_id: str, base_url: str, api_key: str) -> PoeServerModel:
+        with self._lock:
+            key = (model_id, base_url)
+            if key not in self._models:
+                self._models[key] = PoeServerModel(
+                    model_id=model_id,
+                    api_base=base_url,
+                    api_key=api_key,
+                    client_kwargs={
+                        "http_client": self._get_http_client(),
+                        # Retries are handled by ResilientModel
+                        "max_retries": 0,
+                    },
+                )
+            return self._models[key]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            self._models.clear()
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Generator, Iterable
+from dataclasses import asdict, dataclass, fields
+
+from smolagents import ChatMessage, ChatMessageStreamDelta, Model
+
+
+def parse_model_ids(model_ids: str) -> dict[str, float]:
+    """Parses a comma separated list of model ids, optionally weighted, e.g. "Kimi-K2:2,GPT-5"."""
+    weights = {}
+    for model_spec in model_ids.split(","):
+        model_id, _, weight = model_spec.strip().rpartition(":")
+        if not model_id:
+            model_id, weight = weight, "1"
+        weights[model_id] = float(weight)
+    return weights
+
+
+def _sum_stats(stats_list: Iterable):
+    """Sums stats dataclasses of the same type field by field, None if there are none."""
+    stats_list = [stats for stats in stats_list if stats is not None]
+    if not stats_list:
+        return None
+    total = type(stats_list[0])()
+    for field in fields(total):
+        setattr(
+            total, field.name, sum(getattr(stats, field.name) for stats in stats_list)
+        )
+    return total
+
+
+@dataclass
+class RouteStats:
+    """Live stats of a model, as exponentially weighted moving averages."""
+
+    calls: int = 0
+    # Seconds until the response (the first delta, when streaming)
+    latency: float | None = None
+    failure_rate: float = 0.0
+    parse_error_rate: float = 0.0
+
+    def dict(self):
+        return asdict(self)
+
+
+class ModelRouter(Model):
+    """Routes each call to the best of several models, and falls back to the next ones.
+
+    Models are ranked by their expected latency, i.e. their latency inflated by
+    their failure and parse error rates, divided by their weight. Models without
+    any latency yet are assumed to take ``default_latency`` seconds, and ties keep
+    the order in which the models were given, so the first model is preferred
+    until proven slow or unreliable.
+
+    When the call fails (before the first delta, when streaming), it is retried on
+    the next model. When the output of a model fails to parse (see
+    `report_parse_error`), the next call of the same thread skips it.
+
+    With ``stats_path``, the stats are saved after each call and loaded at start,
+    so that routing is warm across runs.
+    """
+
+    def __init__(
+        self,
+        models: list[Model],
+        weights: list[float] | None = None,
+        stats_path: str | None = None,
+        ewma_alpha: float = 0.2,
+        default_latency: float = 10.0,
+        failure_penalty: float = 5.0,
+    ):
+        super().__init__(
+            model_id="router:" + ",".join(model.model_id for model in models)
+        )
+        self.models = models
+        self.weights = weights or [1.0] * len(models)
+        self.stats_path = stats_path
+        self.ewma_alpha = ewma_alpha
+        self.default_latency = default_latency
+        self.failure_penalty = failure_penalty
+        self.route_stats = {model.model_id: RouteStats() for model in models}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if stats_path and os.path.exists(stats_path):
+            with open(stats_path, encoding="utf-8") as file:
+                saved_stats = json.load(file)
+            for model_id, stats in saved_stats.items():
+                if model_id in self.route_stats:
+                    self.route_stats[model_id] = RouteStats(**stats)
+
+    # The stats of the routed models are summed, their route stats are kept apart
+    @property
+    def stop_sequence_stats(self):
+        return _sum_stats(
+            getattr(model, "stop_sequence_stats", None) for model in self.models
+        )
+
+    @property
+    def resilience_stats(self):
+        return _sum_stats(
+            getattr(model, "resilience_stats", None) for model in self.models
+        )
+
+    def _expected_latency(self, model: Model, weight: float) -> float:
+        stats = self.route_stats[model.model_id]
+        latency = self.default_latency if stats.latency is None else stats.latency
+        return (
+            latency
+            * (1 + self.failure_penalty * (stats.failure_rate + stats.parse_error_rate))
+            / weight
+        )
+
+    def ranked_models(self) -> list[Model]:
+        with self._lock:
+            ranked_models = sorted(
+                zip(self.models, self.weights),
+                key=lambda item: self._expected_latency(*item),
+            )
+        ranked_models = [model for model, _ in ranked_models]
+        avoided_model_id = getattr(self._local, "avoided_model_id", None)
+        if avoided_model_id is not None:
+            self._local.avoided_model_id = None
+            ranked_models.sort(key=lambda model: model.model_id == avoided_model_id)
+        return ranked_models
+
+    def _ewma(self, average: float | None, value: float) -> float:
+        if average is None:
+            return value
+        return (1 - self.ewma_alpha) * average + self.ewma_alpha * value
+
+    def _record_call(
+        self, model: Model, latency: float | None = None, failed: bool = False
+    ) -> None:
+        with self._lock:
+            stats = self.route_stats[model.model_id]
+            stats.calls += 1
+            if latency is not None:
+                stats.latency = self._ewma(stats.latency, latency)
+            stats.failure_rate = self._ewma(stats.failure_rate, float(failed))
+            if not failed:
+                # Decays until the output is reported as unparsable
+                stats.parse_error_rate = self._ewma(stats.parse_error_rate, 0.0)
+        self._local.last_model_id = model.model_id
+        self.save_stats()
+
+    def report_parse_error(self) -> None:
+        """Records that the output of the last call of this thread failed to parse."""
+        model_id = getattr(self._local, "last_model_id", None)
+        if model_id is None:
+            return
+        with self._lock:
+            stats = self.route_stats[model_id]
+            # Turns the 0 averaged in by the last call into a 1
+            stats.parse_error_rate += self.ewma_alpha
+        self._local.avoided_model_id = model_id
+        self.save_stats()
+
+    def save_stats(self) -> None:
+        if not self.stats_path:
+            return
+        with self._lock:
+            saved_stats = {
+                model_id: stats.dict() for model_id, stats in self.route_stats.items()
+            }
+            with open(f"{self.stats_path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(saved_stats, file, indent=2)
+            os.replace(f"{self.stats_path}.tmp", self.stats_path)
+
+    def generate(self, *args, **kwargs) -> ChatMessage:
+        ranked_models = self.ranked_models()
+        for index, model in enumerate(ranked_models):
+            start_time = time.time()
+            try:
+                chat_message = model.generate(*args, **kwargs)
+            except Exception:
+                self._record_call(model, failed=True)
+                if index == len(ranked_models) - 1:
+                    raise
+                continue
+            self._record_call(model, latency=time.time() - start_time)
+            return chat_message
+
+    def generate_stream(self, *args, **kwargs) -> Generator[ChatMessageStreamDelta]:
+        ranked_models = self.ranked_models()
+        for index, model in enumerate(ranked_models):
+            start_time = time.time()
+            latency = None
+            try:
+                for event in model.generate_stream(*args, **kwargs):
+                    if latency is None:
+                        latency = time.time() - start_time
+                    yield event
+            except Exception:
+                self._record_call(model, latency=latency, failed=True)
+                # Deltas already yielded can't be taken back
+                if latency is not None or index == len(ranked_models) - 1:
+                    raise
+                continue
+            self._record_call(model, latency=latency)
+            return
@@ -1,15 +1,32 @@
 from args import args
+from context_compaction import ContextCompactor
+from delegation_cache import DelegationCache
 from stats import dump_stats
 from tool import SystemInfoTool
+from tracing import RecordingTracer, get_tracer, set_tracer
 from wrapped_agents import WrappedCodeAgent, WrappedToolCallingAgent, get_agent_model
 
 if __name__ == "__main__":
+    if args.trace_file:
+        set_tracer(RecordingTracer())
     model_id = args.model_id
-    model = get_agent_model(model_id)
+    model = get_agent_model(
+        model_id,
+        cache_dir=args.cache_dir,
+        cache_mode=args.cache_mode,
+        max_retries=args.max_retries,
+        hedge=args.hedge,
+        router_stats_path=args.router_stats_file,
+    )
     agent_type = args.agent_type
     manager_agent_name = f"manager_{agent_type.replace('-', '_')}_agent"
     provider_agent_name = f"provider_{agent_type.replace('-', '_')}_agent"
     agent_class = WrappedCodeAgent if agent_type == "code" else WrappedToolCallingAgent
+    context_compactor = (
+        ContextCompactor(args.max_input_tokens, strategy=args.compaction_strategy)
+        if args.max_input_tokens
+        else None
+    )
 
     provider_agent = agent_class(
         tools=[SystemInfoTool()],
@@ -18,6 +35,7 @@ if __name__ == "__main__":
         verbosity_level=2,
         name=provider_agent_name,
         description="A provider agent, which can fetch system information.",
+        context_compactor=context_compactor,
     )
 
     manager_agent = agent_class(
@@ -28,8 +46,15 @@ if __name__ == "__main__":
         name=manager_agent_name,
         description="A manager agent, which can manage a provider agent",
         managed_agents=[provider_agent],
+        context_compactor=context_compactor,
+        delegation_cache=DelegationCache(ttl=args.delegation_cache_ttl)
+        if args.delegation_cache_ttl > 0
+        else None,
     )
 
     manager_agent.run("What is the system information?")
 
     dump_stats(manager_agent)
+
+    if args.trace_file:
+        get_tracer().export(args.trace_file)
@@ -0,0 +1,309 @@
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+
+from smolagents import local_python_executor
+from smolagents.local_python_executor import DEFAULT_MAX_LEN_OUTPUT, PrintContainer
+from smolagents.utils import MAX_LENGTH_TRUNCATE_CONTENT
+
+# The capture of the code being run, with the key of its step
+_active_capture: ContextVar[tuple["ObservationCapture", str] | None] = ContextVar(
+    "active_capture", default=None
+)
+# Spilled print outputs are written by batches of this many characters
+SPILL_BATCH_CHARS = 1 << 20
+
+
+def _truncation_marker(max_length: int) -> str:
+    # Same marker as truncate_content, which the executor applies afterwards
+    return f"\n..._This content has been truncated to stay below {max_length} characters_...\n"
+
+
+def _head_tail_lengths(max_length: int) -> tuple[int, int]:
+    # Same split as truncate_content, so that truncating again changes nothing
+    return max_length // 2, max_length - max_length // 2
+
+
+# The builtin containers whose repr can be rendered lazily, with their brackets
+_CONTAINER_BRACKETS = {
+    list: ("[", "]"),
+    tuple: ("(", ")"),
+    dict: ("{", "}"),
+    set: ("{", "}"),
+    frozenset: ("frozenset({", "})"),
+}
+
+
+def _container_type(value) -> type | None:
+    """Returns the builtin container type whose repr the value has, if any."""
+    for container_type in _CONTAINER_BRACKETS:
+        # Subclasses are rendered alike unless they define their own repr
+        if (
+            isinstance(value, container_type)
+            and type(value).__repr__ is container_type.__repr__
+        ):
+            return container_type
+    return None
+
+
+def _iter_repr(value, seen: set[int]) -> Iterator[str]:
+    """Yields the repr of a value piece by piece, without building it at once."""
+    container_type = _container_type(value)
+    brackets = _CONTAINER_BRACKETS.get(container_type)
+    if brackets is None:
+        yield repr(value)
+        return
+    if not value:
+        yield repr(value)
+        return
+    if id(value) in seen:
+        # Same as repr for containers containing themselves
+        yield brackets[0] + "..." + brackets[1]
+        return
+    seen.add(id(value))
+    yield brackets[0]
+    items = value.items() if container_type is dict else value
+    for index, item in enumerate(items):
+        if index:
+            yield ", "
+        if container_type is dict:
+            yield from _iter_repr(item[0], seen)
+            yield ": "
+            yield from _iter_repr(item[1], seen)
+        else:
+            yield from _iter_repr(item, seen)
+    if container_type is tuple and len(value) == 1:
+        yield ","
+    yield brackets[1]
+    seen.discard(id(value))
+
+
+def iter_str(value) -> Iterator[str]:
+    """Yields the str of a value piece by piece.
+
+    The str of builtin containers is their repr, which is rendered lazily, while
+    other values can only be rendered at once, by their own str.
+    """
+    if isinstance(value, str):
+        yield value
+    elif _container_type(value) is None:
+        yield str(value)
+    else:
+        yield from _iter_repr(value, set())
+
+
+def bounded_repr(value, max_length: int) -> str:
+    """Returns the str of a value, cut after ``max_length`` + 1 characters.
+
+    Builtin containers are only rendered up to the limit. The extra character
+    tells whether the str was cut.
+    """
+    pieces = []
+    length = 0
+    for piece in iter_str(value):
+        pieces.append(piece)
+        length += len(piece)
+        if length > max_length:
+            break
+    return "".join(pieces)[: max_length + 1]
+
+
+@dataclass
+class ObservationCaptureStats:
+    truncated_logs: int = 0
+    truncated_outputs: int = 0
+    spilled_files: int = 0
+
+    def dict(self):
+        return asdict(self)
+
+
+class BoundedPrintContainer(PrintContainer):
+    """Print outputs of the executor, keeping only their head and tail.
+
+    Without an active `ObservationCapture`, all the print outputs are kept, as with
+    `PrintContainer`. With one, at most ``max_log_chars`` characters are kept, and
+    the full print outputs are written to a file of its ``spill_dir``, if any.
+    """
+
+    def __init__(self):
+        active_capture = _active_capture.get()
+        if active_capture is None:
+            self.max_length = None
+            self.spill_path = None
+        else:
+            capture, step_key = active_capture
+            self.max_length = capture.max_log_chars
+            self.spill_path = capture.spill_path(step_key, "logs")
+        self.truncated = False
+        self.spilled = False
+        # Whether the print outputs are split between their head and their tail
+        self._split = False
+        self._head = ""
+        self._tail = ""
+        self._pending_spill: list[str] = []
+        self._pending_spill_chars = 0
+
+    def _spill(self, text: str) -> None:
+        if self.spill_path is None:
+            return
+        self._pending_spill.append(text)
+        self._pending_spill_chars += len(text)
+        if self._pending_spill_chars >= SPILL_BATCH_CHARS:
+            self._flush_spill()
+
+    def _flush_spill(self) -> None:
+        if not self._pending_spill:
+            return
+        with open(
+            self.spill_path, "a" if self.spilled else "w", encoding="utf-8"
+        ) as file:
+            file.writelines(self._pending_spill)
+        self.spilled = True
+        self._pending_spill.clear()
+        self._pending_spill_chars = 0
+
+    def append(self, text):
+        if self.max_length is None:
+            self._head += text
+            return self
+        if not self._split:
+            text = self._head + text
+            if len(text) <= self.max_length:
+                self._head = text
+                return self
+            self.truncated = True
+            self._split = True
+            self._head = text[: _head_tail_lengths(self.max_length)[0]]
+            self._tail = ""
+        self._spill(text)
+        tail_length = _head_tail_lengths(self.max_length)[1]
+        self._tail += text
+        # Trimmed by halves, to avoid copying the tail on every print
+        if len(self._tail) > 2 * tail_length:
+            self._tail = self._tail[-tail_length:]
+        return self
+
+    def __iadd__(self, other):
+        return self.append(str(other))
+
+    @property
+    def value(self) -> str:
+        if not self._split:
+            return self._head
+        # The print outputs are complete whenever the executor reads them
+        self._flush_spill()
+        tail_length = _head_tail_lengths(self.max_length)[1]
+        return (
+            self._head + _truncation_marker(self.max_length) + self._tail[-tail_length:]
+        )
+
+    @value.setter
+    def value(self, value: str) -> None:
+        # The executor assigns the truncated value at the end of the execution
+        self._flush_spill()
+        self._split = False
+        self._head = value
+        self._tail = ""
+
+
+def install_bounded_print_container() -> None:
+    """Makes the local executor collect print outputs in a `BoundedPrintContainer`."""
+    # UPDATED: bound the print outputs of the local executor while the code runs.
+    # evaluate_python_code creates its PrintContainer by name, and only truncates
+    # it once the code has run.
+    # BEFORE:
+    # state["_print_outputs"] = PrintContainer()
+    # AFTER:
+    local_python_executor.PrintContainer = BoundedPrintContainer
+    # -------
+
+
+class ObservationCapture:
+    """Caps the size of the observations of code actions, whatever the code outputs.
+
+    The print outputs are kept in a `BoundedPrintContainer`, so they never take
+    more than ``max_log_chars`` characters, and the output of the code is rendered
+    with a length limited repr (see `bounded_repr`). With ``spill_dir``, the full
+    print outputs and output are written to files keyed by step, so that nothing
+    is lost when they are truncated.
+    """
+
+    def __init__(
+        self,
+        max_log_chars: int = DEFAULT_MAX_LEN_OUTPUT,
+        max_output_chars: int = MAX_LENGTH_TRUNCATE_CONTENT,
+        spill_dir: str | None = None,
+    ):
+        self.max_log_chars = max_log_chars
+        self.max_output_chars = max_output_chars
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.stats = ObservationCaptureStats()
+
+    def spill_path(self, step_key: str, kind: str) -> str | None:
+        if self.spill_dir is None:
+            return None
+        return os.path.join(self.spill_dir, f"{step_key}.{kind}.txt")
+
+    @contextmanager
+    def capturing(self, step_key: str):
+        """Bounds the print outputs of the code run within, e.g. by the executor."""
+        # The executor is only patched once a capture is used
+        install_bounded_print_container()
+        token = _active_capture.set((self, step_key))
+        try:
+            yield
+        finally:
+            _active_capture.reset(token)
+
+    def record_logs(self, print_outputs: PrintContainer) -> str | None:
+        """Counts the truncation of print outputs, and returns the file they were spilled to."""
+        if not getattr(print_outputs, "truncated", False):
+            return None
+        self.stats.truncated_logs += 1
+        if not print_outputs.spilled:
+            return None
+        self.stats.spilled_files += 1
+        return print_outputs.spill_path
+
+    def render_output(self, output, step_key: str) -> tuple[str, str | None]:
+        """Renders the output of the code, at most ``max_output_chars`` long.
+
+        Returns the rendered output, and the file the full output was spilled to.
+        Values other than builtin containers are rendered once by their str, and
+        only its head and tail are kept.
+        """
+        if isinstance(output, str) or _container_type(output) is None:
+            full_text = str(output)
+            text = full_text[: self.max_output_chars + 1]
+        else:
+            full_text = None
+            text = bounded_repr(output, self.max_output_chars)
+        if len(text) <= self.max_output_chars:
+            return text, None
+        self.stats.truncated_outputs += 1
+        head_length, tail_length = _head_tail_lengths(self.max_output_chars)
+        if full_text is not None:
+            text = (
+                full_text[:head_length]
+                + _truncation_marker(self.max_output_chars)
+                + full_text[-tail_length:]
+            )
+        else:
+            # The end of the repr was not rendered
+            text = text[: self.max_output_chars] + _truncation_marker(
+                self.max_output_chars
+            )
+        spill_path = self.spill_path(step_key, "output")
+        if spill_path is not None:
+            with open(spill_path, "w", encoding="utf-8") as file:
+                # Containers are written piece by piece, without their full repr
+                file.writelines(
+                    [full_text] if full_text is not None else iter_str(output)
+                )
+            self.stats.spilled_files += 1
+        return text, spill_path
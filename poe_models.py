@@ -0,0 +1,163 @@
+from collections.abc import Generator
+from dataclasses import dataclass
+
+from smolagents import (
+    ChatMessage,
+    ChatMessageStreamDelta,
+    OpenAIServerModel,
+    TokenUsage,
+    Tool,
+)
+from smolagents.models import ChatMessageToolCallStreamDelta
+
+from streaming import StopSequenceMatcher, find_stop_sequence
+from token_counting import count_tokens
+
+
+@dataclass
+class StopSequenceStats:
+    streams_aborted: int = 0
+    outputs_trimmed: int = 0
+    trimmed_output_tokens: int = 0
+
+    def dict(self):
+        return {
+            "streams_aborted": self.streams_aborted,
+            "outputs_trimmed": self.outputs_trimmed,
+            "trimmed_output_tokens": self.trimmed_output_tokens,
+        }
+
+
+def _count_message_tokens(messages: list[dict]) -> int:
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content)
+        elif isinstance(content, list):
+            total += sum(
+                count_tokens(part.get("text", ""))
+                for part in content
+                if isinstance(part, dict)
+            )
+    return total
+
+
+class PoeServerModel(OpenAIServerModel):
+    """OpenAIServerModel for the Poe API.
+
+    Poe fails on some models when the stop parameter is sent, so it is never sent
+    (see `models.supports_stop_parameter`) and stop sequences are enforced on the
+    client side instead:
+    - when streaming, the stream is closed as soon as a stop sequence shows up, so
+    the model stops generating tokens we would throw away;
+    - otherwise, the output is trimmed at the first stop sequence.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_sequence_stats = StopSequenceStats()
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta]:
+        completion_kwargs = self._prepare_completion_kwargs(
+            messages=messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            model=self.model_id,
+            custom_role_conversions=self.custom_role_conversions,
+            convert_images_to_image_urls=True,
+            **kwargs,
+        )
+        stop_matcher = StopSequenceMatcher(stop_sequences or [])
+        emitted_content: list[str] = []
+        self._apply_rate_limit()
+        # Using the stream as a context manager closes the HTTP response as soon as
+        # we stop consuming it
+        with self.client.chat.completions.create(
+            **completion_kwargs, stream=True, stream_options={"include_usage": True}
+        ) as stream:
+            for event in stream:
+                if event.usage:
+                    yield ChatMessageStreamDelta(
+                        content="",
+                        token_usage=TokenUsage(
+                            input_tokens=event.usage.prompt_tokens,
+                            output_tokens=event.usage.completion_tokens,
+                        ),
+                    )
+                if event.choices:
+                    choice = event.choices[0]
+                    if choice.delta:
+                        content = choice.delta.content
+                        if content:
+                            content = stop_matcher.feed(content)
+                            emitted_content.append(content)
+                        yield ChatMessageStreamDelta(
+                            content=content,
+                            tool_calls=[
+                                ChatMessageToolCallStreamDelta(
+                                    index=delta.index,
+                                    id=delta.id,
+                                    type=delta.type,
+                                    function=delta.function,
+                                )
+                                for delta in choice.delta.tool_calls
+                            ]
+                            if choice.delta.tool_calls
+                            else None,
+                        )
+                        if stop_matcher.stopped:
+                            break
+                    else:
+                        if not getattr(choice, "finish_reason", None):
+                            raise ValueError(
+                                f"No content or tool calls in event: {event}"
+                            )
+
+        if stop_matcher.stopped:
+            # The usage event is only sent at the end of the stream, so estimate it
+            self.stop_sequence_stats.streams_aborted += 1
+            yield ChatMessageStreamDelta(
+                content="",
+                token_usage=TokenUsage(
+                    input_tokens=_count_message_tokens(completion_kwargs["messages"]),
+                    output_tokens=count_tokens("".join(emitted_content)),
+                ),
+            )
+        else:
+            remaining_content = stop_matcher.flush()
+            if remaining_content:
+                yield ChatMessageStreamDelta(content=remaining_content)
+
+    def generate(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,
+    ) -> ChatMessage:
+        chat_message = super().generate(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        if stop_sequences and isinstance(chat_message.content, str):
+            index = find_stop_sequence(chat_message.content, stop_sequences)
+            if index >= 0:
+                self.stop_sequence_stats.outputs_trimmed += 1
+                self.stop_sequence_stats.trimmed_output_tokens += count_tokens(
+                    chat_message.content[index:]
+                )
+                chat_message.content = chat_message.content[:index]
+        return chat_message
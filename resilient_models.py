@@ -0,0 +1,344 @@
+import queue
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Generator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any
+
+import openai
+from smolagents import ChatMessage, ChatMessageStreamDelta, Model
+
+from ledger import _percentile, current_step_timer
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed request is worth retrying: connection errors, timeouts, 429 and 5xx."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError))
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """Fails fast while a model is unhealthy.
+
+    After ``failure_threshold`` consecutive transient failures the circuit opens,
+    and calls fail immediately for ``reset_timeout`` seconds. Then a single trial
+    call is let through (half open): its success closes the circuit, its failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            if (
+                self.state == "open"
+                and time.time() - self._opened_at >= self.reset_timeout
+            ):
+                self.state = "half_open"
+                return
+            raise CircuitOpenError(
+                f"Circuit open after {self.consecutive_failures} consecutive failures, "
+                f"retrying in at most {self.reset_timeout}s"
+            )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if (
+                self.state == "half_open"
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.time()
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_id: str) -> CircuitBreaker:
+    """Returns the circuit breaker of a model, shared by all the agents using it."""
+    with _circuit_breakers_lock:
+        if model_id not in _circuit_breakers:
+            _circuit_breakers[model_id] = CircuitBreaker()
+        return _circuit_breakers[model_id]
+
+
+@dataclass
+class ResilienceStats:
+    retries: int = 0
+    hedges_started: int = 0
+    hedges_won: int = 0
+    circuit_open_rejections: int = 0
+
+    def dict(self):
+        return {
+            "retries": self.retries,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "circuit_open_rejections": self.circuit_open_rejections,
+        }
+
+
+class _StreamAttempt:
+    """Consumes a stream in a thread, so that several streams can be raced."""
+
+    def __init__(self, index: int, stream: Generator, events: queue.Queue):
+        self.index = index
+        self.cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(stream, events), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, stream: Generator, events: queue.Queue) -> None:
+        try:
+            try:
+                for event in stream:
+                    if self.cancelled.is_set():
+                        return
+                    events.put((self.index, "delta", event))
+            finally:
+                stream.close()
+        except Exception as e:
+            events.put((self.index, "error", e))
+        else:
+            events.put((self.index, "end", None))
+
+
+class ResilientModel(Model):
+    """Retries, hedges and circuit-breaks the requests of a model.
+
+    - Transient errors (see `is_transient_error`) are retried with jittered
+    exponential backoff. A stream is only retried until its first delta.
+    - With ``hedge=True``, when a request gets no response (first delta, when
+    streaming) within the ``hedge_percentile`` of the latencies observed so far,
+    a second identical request is sent and the first one to respond is used.
+    - The circuit breaker of the model id fails fast while the model is unhealthy.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        retry_policy: RetryPolicy | None = None,
+        hedge: bool = False,
+        hedge_percentile: int = 95,
+        hedge_min_samples: int = 10,
+        latency_window_size: int = 100,
+    ):
+        super().__init__(model_id=model.model_id)
+        self.model = model
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.circuit_breaker = get_circuit_breaker(model.model_id)
+        self.resilience_stats = ResilienceStats()
+        self._latencies: dict[str, deque[float]] = {
+            "generate": deque(maxlen=latency_window_size),
+            "generate_stream": deque(maxlen=latency_window_size),
+        }
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose the attributes of the wrapped model, e.g. its stats
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _record_latency(self, method: str, latency: float) -> None:
+        with self._lock:
+            self._latencies[method].append(latency)
+
+    def _hedge_delay(self, method: str) -> float | None:
+        if not self.hedge:
+            return None
+        with self._lock:
+            latencies = list(self._latencies[method])
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return _percentile(latencies, self.hedge_percentile)
+
+    def _before_attempt(self) -> None:
+        try:
+            self.circuit_breaker.before_call()
+        except CircuitOpenError:
+            self.resilience_stats.circuit_open_rejections += 1
+            raise
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if not is_transient_error(error):
+            # The model responded, e.g. with a 400, so it is healthy
+            self.circuit_breaker.record_success()
+            return False
+        self.circuit_breaker.record_failure()
+        if attempt >= self.retry_policy.max_retries:
+            return False
+        self.resilience_stats.retries += 1
+        step_timer = current_step_timer()
+        if step_timer is not None:
+            step_timer.retries += 1
+        time.sleep(self.retry_policy.delay(attempt))
+        return True
+
+    def _generate_hedged(self, *args, **kwargs) -> ChatMessage:
+        start_time = time.time()
+        hedge_delay = self._hedge_delay("generate")
+        if hedge_delay is None:
+            chat_message = self.model.generate(*args, **kwargs)
+        else:
+            executor = ThreadPoolExecutor(max_workers=2)
+            try:
+                futures = [executor.submit(self.model.generate, *args, **kwargs)]
+                done, _ = wait(futures, timeout=hedge_delay)
+                if not done:
+                    self.resilience_stats.hedges_started += 1
+                    futures.append(
+                        executor.submit(self.model.generate, *args, **kwargs)
+                    )
+                pending = set(futures)
+                while True:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    # The first successful response wins, errors only if all failed
+                    winners = [future for future in done if future.exception() is None]
+                    if winners or not pending:
+                        future = winners[0] if winners else done.pop()
+                        break
+                if future is not futures[0]:
+                    self.resilience_stats.hedges_won += 1
+                chat_message = future.result()
+            finally:
+                executor.shutdown(wait=False)
+        self._record_latency("generate", time.time() - start_time)
+        return chat_message
+
+    def generate(self, *args, **kwargs) -> ChatMessage:
+        attempt = 0
+        while True:
+            self._before_attempt()
+            try:
+                chat_message = self._generate_hedged(*args, **kwargs)
+            except Exception as e:
+                if self._should_retry(e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            self.circuit_breaker.record_success()
+            return chat_message
+
+    def _stream_hedged(self, *args, **kwargs) -> Generator[ChatMessageStreamDelta]:
+        start_time = time.time()
+        hedge_delay = self._hedge_delay("generate_stream")
+        if hedge_delay is None:
+            first_delta = True
+            for event in self.model.generate_stream(*args, **kwargs):
+                if first_delta:
+                    self._record_latency("generate_stream", time.time() - start_time)
+                    first_delta = False
+                yield event
+            return
+
+        events: queue.Queue = queue.Queue()
+        attempts = [
+            _StreamAttempt(0, self.model.generate_stream(*args, **kwargs), events)
+        ]
+        winner: _StreamAttempt | None = None
+        errors: list[Exception] = []
+        try:
+            while True:
+                try:
+                    index, kind, payload = events.get(
+                        timeout=hedge_delay
+                        if len(attempts) == 1 and winner is None
+                        else None
+                    )
+                except queue.Empty:
+                    self.resilience_stats.hedges_started += 1
+                    attempts.append(
+                        _StreamAttempt(
+                            1, self.model.generate_stream(*args, **kwargs), events
+                        )
+                    )
+                    continue
+                if winner is None:
+                    if kind == "error":
+                        errors.append(payload)
+                        if len(errors) < len(attempts):
+                            continue
+                        raise errors[0]
+                    winner = attempts[index]
+                    self._record_latency("generate_stream", time.time() - start_time)
+                    if index > 0:
+                        self.resilience_stats.hedges_won += 1
+                    for attempt in attempts:
+                        if attempt is not winner:
+                            attempt.cancelled.set()
+                if index != winner.index:
+                    continue
+                if kind == "error":
+                    raise payload
+                if kind == "end":
+                    return
+                yield payload
+        finally:
+            for attempt in attempts:
+                attempt.cancelled.set()
+
+    def generate_stream(self, *args, **kwargs) -> Generator[ChatMessageStreamDelta]:
+        attempt = 0
+        while True:
+            self._before_attempt()
+            has_yielded = False
+            try:
+                for event in self._stream_hedged(*args, **kwargs):
+                    has_yielded = True
+                    yield event
+            except GeneratorExit:
+                # Closed by the consumer, which can only happen once a delta was
+                # yielded, so the model responded. The call must be recorded, or a
+                # half open circuit would stay half open and reject every call
+                self.circuit_breaker.record_success()
+                raise
+            except Exception as e:
+                # Deltas already yielded can't be taken back
+                if not has_yielded and self._should_retry(e, attempt):
+                    attempt += 1
+                    continue
+                if has_yielded and is_transient_error(e):
+                    self.circuit_breaker.record_failure()
+                raise
+            self.circuit_breaker.record_success()
+            return
@@ -1,20 +1,40 @@
 from args import args
+from context_compaction import ContextCompactor
 from stats import dump_stats
+from tracing import RecordingTracer, get_tracer, set_tracer
 from wrapped_agents import WrappedCodeAgent, WrappedToolCallingAgent, get_agent_model
 
 if __name__ == "__main__":
+    if args.trace_file:
+        set_tracer(RecordingTracer())
     model_id = args.model_id
-    model = get_agent_model(model_id)
+    model = get_agent_model(
+        model_id,
+        cache_dir=args.cache_dir,
+        cache_mode=args.cache_mode,
+        max_retries=args.max_retries,
+        hedge=args.hedge,
+        router_stats_path=args.router_stats_file,
+    )
     agent_type = args.agent_type
     agent_class = WrappedCodeAgent if agent_type == "code" else WrappedToolCallingAgent
 
     agent_name = f"{agent_type.replace('-', '_')}_agent"
+    context_compactor = (
+        ContextCompactor(args.max_input_tokens, strategy=args.compaction_strategy)
+        if args.max_input_tokens
+        else None
+    )
     agent = agent_class(
         tools=[],
         model=model,
         verbosity_level=2,
         name=agent_name,
+        context_compactor=context_compactor,
     )
     agent.run("Tell me about you", max_steps=3)
 
     dump_stats(agent)
+
+    if args.trace_file:
+        get_tracer().export(args.trace_file)
@@ -0,0 +1,147 @@
+import copy
+import json
+import re
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+
+from smolagents import LocalPythonExecutor
+from smolagents.local_python_executor import CodeOutput
+
+_CODE_FIELD_PATTERN = re.compile(r'"code"\s*:\s*"')
+# Longest start of the "code" field kept between deltas, whitespace included
+_MAX_CODE_FIELD_PREFIX_LENGTH = 64
+
+
+@dataclass
+class SpeculationStats:
+    started: int = 0
+    committed: int = 0
+    discarded: int = 0
+    # Time during which the execution overlapped with the rest of the stream
+    overlapped_time: float = 0.0
+
+    def dict(self):
+        return {
+            "started": self.started,
+            "committed": self.committed,
+            "discarded": self.discarded,
+            "overlapped_time": self.overlapped_time,
+        }
+
+
+class CodeBlockDetector:
+    """Detects, while the output is streamed, the moment the code of the action is complete.
+
+    The code is complete once its code block is closed, or in structured mode once
+    the string of the ``"code"`` field is closed. Deltas are scanned as they come,
+    and the full text is only joined when the last delta may have completed the
+    code block, so detection stays linear in the output length. ``code_end`` is
+    then the end of the code block in the output.
+    """
+
+    def __init__(
+        self,
+        closing_tag: str,
+        structured: bool,
+        extract_code: Callable[[str], str | None],
+    ):
+        self.closing_tag = closing_tag
+        self.structured = structured
+        self.extract_code = extract_code
+        self._chunks: list[str] = []
+        # End of the text seen so far, which may hold the start of a closing tag
+        # or of the "code" field split across deltas
+        self._tail = ""
+        # In structured mode, the chars of the "code" string once it started
+        self._code_chars: list[str] | None = None
+        self._escaped = False
+        self._length = 0
+        self.code_end: int | None = None
+
+    def feed(self, delta: str) -> str | None:
+        """Returns the code if it was completed by this delta of the output."""
+        if self.structured:
+            return self._feed_structured(delta)
+        self._chunks.append(delta)
+        self._length += len(delta)
+        text = self._tail + delta
+        self._tail = text[max(0, len(text) - len(self.closing_tag) + 1) :]
+        if self.closing_tag not in text:
+            return None
+        code = self.extract_code("".join(self._chunks))
+        if code is not None:
+            self.code_end = (
+                self._length
+                - len(text)
+                + text.rindex(self.closing_tag)
+                + len(self.closing_tag)
+            )
+        return code
+
+    def _feed_structured(self, delta: str) -> str | None:
+        if self._code_chars is None:
+            text = self._tail + delta
+            match = _CODE_FIELD_PATTERN.search(text)
+            if match is None:
+                self._tail = text[-_MAX_CODE_FIELD_PREFIX_LENGTH:]
+                return None
+            self._code_chars = ['"']
+            delta = text[match.end() :]
+        for index, char in enumerate(delta):
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._code_chars.append(delta[: index + 1])
+                code = json.loads("".join(self._code_chars), strict=False)
+                return self.extract_code(code) or code
+        self._code_chars.append(delta)
+        return None
+
+
+class SpeculativeExecution:
+    """Runs the code of an action in the background, before the end of the stream.
+
+    The code runs on a copy of the executor, with shallow copies of its variables
+    and functions, so that discarding the execution leaves the executor untouched.
+    Committing it copies them back into the executor. Objects mutated in place and
+    the side effects of tools are not isolated, so speculation should only be
+    enabled with tools which are safe to call twice.
+    """
+
+    def __init__(self, python_executor: LocalPythonExecutor, code_action: str):
+        self.python_executor = python_executor
+        self.code_action = code_action
+        self.start_time = time.time()
+        self.end_time: float | None = None
+        self._executor = copy.copy(python_executor)
+        self._executor.state = dict(python_executor.state)
+        self._executor.custom_tools = dict(python_executor.custom_tools)
+        self._thread_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="speculative-execution"
+        )
+        self._future: Future = self._thread_pool.submit(copy_context().run, self._run)
+        self._thread_pool.shutdown(wait=False)
+
+    def _run(self) -> CodeOutput:
+        try:
+            return self._executor(self.code_action)
+        finally:
+            self.end_time = time.time()
+
+    def wait(self) -> None:
+        """Waits for the end of the execution, without raising its error."""
+        self._future.exception()
+
+    def commit(self) -> CodeOutput:
+        """Applies the execution to the executor, and returns its output or raises its error."""
+        self.wait()
+        self.python_executor.state.clear()
+        self.python_executor.state.update(self._executor.state)
+        self.python_executor.custom_tools.clear()
+        self.python_executor.custom_tools.update(self._executor.custom_tools)
+        return self._future.result()
@@ -1,11 +1,98 @@
-from wrapped_agents import get_all_messages
+import json
+import sys
+
+from events import AgentEvent, ConsoleSink
+from transcript import export_messages_text, iter_message_records
+
+
+def collect_stats(agent) -> dict:
+    """Returns the stats of the agent and its model, keyed by their name."""
+    stats = {"total_input_tokens": agent.total_input_tokens}
+
+    ledger = getattr(agent, "ledger", None)
+    if ledger is not None:
+        stats["ledger_summary"] = ledger.summary()
+
+    for name in (
+        "stop_sequence_stats",
+        "route_stats",
+        "resilience_stats",
+        "cache_stats",
+    ):
+        model_stats = getattr(agent.model, name, None)
+        if model_stats is None:
+            continue
+        if name == "route_stats":
+            stats[name] = {
+                model_id: route_stats.dict()
+                for model_id, route_stats in model_stats.items()
+            }
+        else:
+            stats[name] = model_stats.dict()
+
+    for name in (
+        "parsing_recovery_stats",
+        "speculation_stats",
+        "observation_capture_stats",
+        "delegation_cache_stats",
+    ):
+        agent_stats = getattr(agent, name, None)
+        if agent_stats is not None:
+            stats[name] = agent_stats.dict()
+    return stats
 
 
 def dump_stats(agent):
+    stats = collect_stats(agent)
+    event_sink = getattr(agent, "event_sink", None)
+    if event_sink is not None:
+        event_sink.emit(
+            AgentEvent(
+                type="stats", agent_name=agent.name, step_number=None, data=stats
+            )
+        )
+    if event_sink is not None and not isinstance(event_sink, ConsoleSink):
+        # Headless agents, e.g. in workers, send the messages to their sink too,
+        # rather than printing them
+        event_sink.emit(
+            AgentEvent(
+                type="transcript",
+                agent_name=agent.name,
+                step_number=None,
+                data={"messages": list(iter_message_records(agent))},
+            )
+        )
+        return
+
     print("Dumping agent messages:")
     print("***********************")
-    all_messages = get_all_messages(agent)
-    for message in all_messages:
-        print(message)
+    export_messages_text(agent, sys.stdout)
+
+    print(f"Total input tokens = {stats['total_input_tokens']}")
+
+    if "ledger_summary" in stats:
+        print(f"Ledger summary = {json.dumps(stats['ledger_summary'], indent=2)}")
+
+    if "stop_sequence_stats" in stats:
+        print(f"Stop sequence stats = {stats['stop_sequence_stats']}")
+
+    if "route_stats" in stats:
+        print(f"Route stats = {json.dumps(stats['route_stats'], indent=2)}")
+
+    if "resilience_stats" in stats:
+        print(f"Resilience stats = {stats['resilience_stats']}")
+
+    if "cache_stats" in stats:
+        print(f"Cache stats = {stats['cache_stats']}")
+
+    if "parsing_recovery_stats" in stats:
+        print(f"Parsing recovery stats = {stats['parsing_recovery_stats']}")
+
+    if "speculation_stats" in stats:
+        print(f"Speculation stats = {stats['speculation_stats']}")
+
+    if "observation_capture_stats" in stats:
+        print(f"Observation capture stats = {stats['observation_capture_stats']}")
 
-    print(f"Total input tokens = {agent.total_input_tokens}")
+    if "delegation_cache_stats" in stats:
+        print(f"Delegation cache stats = {stats['delegation_cache_stats']}")
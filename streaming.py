@@ -0,0 +1,187 @@
+import time
+
+from smolagents import (
+    ChatMessage,
+    ChatMessageStreamDelta,
+    ChatMessageToolCall,
+    MessageRole,
+    TokenUsage,
+)
+from smolagents.models import ChatMessageToolCallFunction
+
+
+class _ToolCallAccumulator:
+    def __init__(self, id: str | None, type: str | None):
+        self.id = id
+        self.type = type
+        self.name = ""
+        self.argument_parts: list[str] = []
+
+
+class StreamAccumulator:
+    """Folds stream deltas into a running chat message.
+
+    Equivalent to calling ``agglomerate_stream_deltas`` on every delta received
+    so far, but each delta is folded in O(1): content and tool call arguments are
+    kept as lists of chunks, and only joined when the message is requested.
+    """
+
+    def __init__(self, role: MessageRole = MessageRole.ASSISTANT):
+        self.role = role
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._content = ""
+        self._pending_content_parts: list[str] = []
+        self._content_length = 0
+        self._tool_calls: dict[int, _ToolCallAccumulator] = {}
+
+    def add(self, stream_delta: ChatMessageStreamDelta) -> None:
+        if stream_delta.token_usage:
+            self.input_tokens += stream_delta.token_usage.input_tokens
+            self.output_tokens += stream_delta.token_usage.output_tokens
+        if stream_delta.content:
+            self._pending_content_parts.append(stream_delta.content)
+            self._content_length += len(stream_delta.content)
+        if stream_delta.tool_calls:
+            for tool_call_delta in stream_delta.tool_calls:
+                if tool_call_delta.index is None:
+                    raise ValueError(
+                        f"Tool call index is not provided in tool delta: {tool_call_delta}"
+                    )
+                tool_call = self._tool_calls.get(tool_call_delta.index)
+                if tool_call is None:
+                    tool_call = _ToolCallAccumulator(
+                        id=tool_call_delta.id, type=tool_call_delta.type
+                    )
+                    self._tool_calls[tool_call_delta.index] = tool_call
+                if tool_call_delta.id:
+                    tool_call.id = tool_call_delta.id
+                if tool_call_delta.type:
+                    tool_call.type = tool_call_delta.type
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call.name = tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call.argument_parts.append(
+                            tool_call_delta.function.arguments
+                        )
+
+    @property
+    def content_length(self) -> int:
+        return self._content_length
+
+    @property
+    def content(self) -> str:
+        # Only join the chunks received since the last call
+        if self._pending_content_parts:
+            self._content += "".join(self._pending_content_parts)
+            self._pending_content_parts.clear()
+        return self._content
+
+    def to_chat_message(self) -> ChatMessage:
+        return ChatMessage(
+            role=self.role,
+            content=self.content,
+            tool_calls=[
+                ChatMessageToolCall(
+                    function=ChatMessageToolCallFunction(
+                        name=tool_call.name,
+                        arguments="".join(tool_call.argument_parts),
+                    ),
+                    id=tool_call.id or "",
+                    type="function",
+                )
+                for tool_call in self._tool_calls.values()
+            ],
+            token_usage=TokenUsage(
+                input_tokens=self.input_tokens,
+                output_tokens=self.output_tokens,
+            ),
+        )
+
+    def render_as_markdown(self) -> str:
+        return self.to_chat_message().render_as_markdown()
+
+
+class RenderThrottle:
+    """Decides when a live view should be refreshed while streaming.
+
+    A refresh is due once ``interval`` seconds have passed since the last one, or
+    once ``max_pending_chars`` characters have been received without a refresh.
+    Set ``max_pending_chars`` to None to refresh on time only, which keeps the
+    number of refreshes independent from the length of the output.
+    """
+
+    def __init__(self, interval: float = 0.1, max_pending_chars: int | None = None):
+        self.interval = interval
+        self.max_pending_chars = max_pending_chars
+        self._last_render_time = 0.0
+        self._pending_chars = 0
+
+    def should_render(self, new_chars: int) -> bool:
+        self._pending_chars += new_chars
+        now = time.monotonic()
+        if now - self._last_render_time >= self.interval or (
+            self.max_pending_chars is not None
+            and self._pending_chars >= self.max_pending_chars
+        ):
+            self._last_render_time = now
+            self._pending_chars = 0
+            return True
+        return False
+
+
+def find_stop_sequence(text: str, stop_sequences: list[str]) -> int:
+    """Returns the index of the earliest stop sequence in the text, or -1."""
+    indices = [text.find(s) for s in stop_sequences if s]
+    indices = [i for i in indices if i >= 0]
+    return min(indices) if indices else -1
+
+
+def truncate_at_stop_sequences(text: str, stop_sequences: list[str]) -> str:
+    index = find_stop_sequence(text, stop_sequences)
+    return text if index < 0 else text[:index]
+
+
+class StopSequenceMatcher:
+    """Detects stop sequences in streamed text.
+
+    ``feed`` returns the part of the text which can safely be emitted. A tail which
+    could be the beginning of a stop sequence split across chunks is held back
+    until the next chunk disambiguates it, or until ``flush`` is called.
+    """
+
+    def __init__(self, stop_sequences: list[str]):
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.stopped = False
+        self._buffer = ""
+
+    def feed(self, text: str) -> str:
+        if self.stopped or not text:
+            return ""
+        self._buffer += text
+        index = find_stop_sequence(self._buffer, self.stop_sequences)
+        if index >= 0:
+            self.stopped = True
+            emitted, self._buffer = self._buffer[:index], ""
+            return emitted
+        held_back = self._partial_match_length()
+        emitted = self._buffer[: len(self._buffer) - held_back]
+        self._buffer = self._buffer[len(self._buffer) - held_back :]
+        return emitted
+
+    def flush(self) -> str:
+        emitted, self._buffer = self._buffer, ""
+        return emitted
+
+    def _partial_match_length(self) -> int:
+        # Longest suffix of the buffer which is a strict prefix of a stop sequence
+        longest = 0
+        for stop_sequence in self.stop_sequences:
+            for length in range(
+                min(len(stop_sequence) - 1, len(self._buffer)), longest, -1
+            ):
+                if self._buffer.endswith(stop_sequence[:length]):
+                    longest = length
+                    break
+        return longest
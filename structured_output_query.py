@@ -1,13 +1,33 @@
 from args import args
+from checkpoint import SessionCheckpoint
+from context_compaction import ContextCompactor
 from stats import dump_stats
 from tool import get_system_info
+from tracing import RecordingTracer, get_tracer, set_tracer
 from wrapped_agents import WrappedCodeAgent, WrappedToolCallingAgent, get_agent_model
 
 if __name__ == "__main__":
+    if args.trace_file:
+        set_tracer(RecordingTracer())
     model_id = args.model_id
-    model = get_agent_model(model_id)
+    model = get_agent_model(
+        model_id,
+        cache_dir=args.cache_dir,
+        cache_mode=args.cache_mode,
+        max_retries=args.max_retries,
+        hedge=args.hedge,
+        router_stats_path=args.router_stats_file,
+    )
     agent_type = args.agent_type
     agent_name = f"{agent_type.replace('-', '_')}_agent"
+    session_checkpoint = (
+        SessionCheckpoint(args.checkpoint_dir) if args.checkpoint_dir else None
+    )
+    context_compactor = (
+        ContextCompactor(args.max_input_tokens, strategy=args.compaction_strategy)
+        if args.max_input_tokens
+        else None
+    )
     if agent_type == "code":
         agent = WrappedCodeAgent(
             tools=[get_system_info],
@@ -15,6 +35,8 @@ if __name__ == "__main__":
             verbosity_level=2,
             name=agent_name,
             use_structured_outputs_internally=True,
+            session_checkpoint=session_checkpoint,
+            context_compactor=context_compactor,
         )
     else:
         agent = WrappedToolCallingAgent(
@@ -22,12 +44,19 @@ if __name__ == "__main__":
             model=model,
             verbosity_level=2,
             name=agent_name,
+            session_checkpoint=session_checkpoint,
+            context_compactor=context_compactor,
         )
 
-    result = agent.run("What is the system information?", max_steps=3)
+    # A resumed session continues with the follow-up question
+    if not agent.memory.steps:
+        result = agent.run("What is the system information?", max_steps=3)
 
-    print(f"Result: {result}")
-    print(f"Result type: {type(result).__name__}")
+        print(f"Result: {result}")
+        print(f"Result type: {type(result).__name__}")
     agent.run("Are there more than 20 MB of memory free?", max_steps=3, reset=False)
 
     dump_stats(agent)
+
+    if args.trace_file:
+        get_tracer().export(args.trace_file)
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class StubResponse:
+    content: str | None = None
+    # OpenAI tool calls: {"id": ..., "name": ..., "arguments": {...}}
+    tool_calls: list[dict] = field(default_factory=list)
+
+
+def _count_tokens(text: str) -> int:
+    # Same heuristic as the token_counting fallback, tiktoken is not needed here
+    return len(text) // 4
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content)
+    return content
+
+
+class StubPoeServer:
+    """Local OpenAI-compatible chat completions server, to run agents offline.
+
+    Each request is answered with the response returned by ``responder`` for the
+    request body. Responses are streamed (server-sent events) when the request
+    asks for it, in chunks of ``chunk_size`` characters sent every
+    ``chunk_delay`` seconds, after a ``latency`` seconds wait.
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[dict], StubResponse],
+        latency: float = 0.0,
+        chunk_size: int = 16,
+        chunk_delay: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.responder = responder
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubPoeServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-poe-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubPoeServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _usage(self, body: dict, response: StubResponse) -> dict:
+        prompt_tokens = sum(
+            _count_tokens(message_text(message)) for message in body["messages"]
+        )
+        completion_tokens = _count_tokens(
+            (response.content or "")
+            + "".join(json.dumps(call["arguments"]) for call in response.tool_calls)
+        )
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, body: dict, response: StubResponse) -> dict:
+        message = {"role": "assistant", "content": response.content}
+        if response.tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {
+                        "name": call["name"],
+                        "arguments": json.dumps(call["arguments"]),
+                    },
+                }
+                for call in response.tool_calls
+            ]
+        return {
+            "id": f"chatcmpl-stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if response.tool_calls else "stop",
+                }
+            ],
+            "usage": self._usage(body, response),
+        }
+
+    def _chunks(self, body: dict, response: StubResponse):
+        def chunk(delta: dict | None, finish_reason: str | None = None, **extra):
+            return {
+                "id": f"chatcmpl-stub-{self.requests}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": []
+                if delta is None
+                else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+
+        content = response.content or ""
+        for start in range(0, len(content), self.chunk_size):
+            yield chunk({"content": content[start : start + self.chunk_size]})
+        for index, call in enumerate(response.tool_calls):
+            yield chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "id": call["id"],
+                            "type": "function",
+                            "function": {"name": call["name"], "arguments": ""},
+                        }
+                    ]
+                }
+            )
+            arguments = json.dumps(call["arguments"])
+            for start in range(0, len(arguments), self.chunk_size):
+                yield chunk(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": index,
+                                "function": {
+                                    "arguments": arguments[
+                                        start : start + self.chunk_size
+                                    ]
+                                },
+                            }
+                        ]
+                    }
+                )
+        yield chunk({}, "tool_calls" if response.tool_calls else "stop")
+        if body.get("stream_options", {}).get("include_usage"):
+            yield chunk(None, usage=self._usage(body, response))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, which Nagle's algorithm
+            # would delay until the client acknowledges, i.e. ~40ms per request
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requests += 1
+                response = server.responder(body)
+                time.sleep(server.latency)
+                if not body.get("stream"):
+                    payload = json.dumps(server._completion(body, response)).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for event in server._chunks(body, response):
+                        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                        time.sleep(server.chunk_delay)
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream, e.g. on a stop sequence
+                    self.close_connection = True
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
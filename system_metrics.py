@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import psutil
+
+MB = 1024 * 1024
+
+
+@dataclass
+class MetricsSample:
+    timestamp: float
+    cpu_percent: float
+    memory_total_mb: int
+    memory_used_mb: int
+    per_cpu_percent: list[float] = field(default_factory=list)
+    # Processes using the most memory, largest first
+    top_processes: list[dict] = field(default_factory=list)
+
+
+class SystemMetricsProvider:
+    """Samples system metrics in a background thread.
+
+    ``psutil.cpu_percent`` needs two readings some time apart, which blocks when
+    called with an interval. Instead, a daemon thread samples every ``interval``
+    seconds (non-blocking readings since the previous sample) into a rolling
+    window of ``window_size`` samples, and readers get the latest sample without
+    blocking. Only the very first read waits for the first sample. Each sample
+    also holds the ``max_top_processes`` processes using the most memory.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        window_size: int = 120,
+        max_staleness: float = 2.0,
+        max_top_processes: int = 10,
+    ):
+        self.interval = interval
+        self.max_top_processes = max_top_processes
+        self.max_staleness = max_staleness
+        self.samples: deque[MetricsSample] = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._first_sample = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _top_processes(self) -> list[dict]:
+        if self.max_top_processes <= 0:
+            return []
+        # Memory only: per process CPU readings would need their own sampling
+        processes = [
+            process.info
+            for process in psutil.process_iter(["pid", "name", "memory_info"])
+            if process.info.get("memory_info") is not None
+        ]
+        processes.sort(key=lambda info: info["memory_info"].rss, reverse=True)
+        return [
+            {
+                "pid": info["pid"],
+                "name": info["name"],
+                "memory_rss_mb": info["memory_info"].rss // MB,
+            }
+            for info in processes[: self.max_top_processes]
+        ]
+
+    def _sample(self) -> MetricsSample:
+        virtual_mem = psutil.virtual_memory()
+        per_cpu_percent = psutil.cpu_percent(percpu=True)
+        return MetricsSample(
+            timestamp=time.time(),
+            cpu_percent=sum(per_cpu_percent) / len(per_cpu_percent)
+            if per_cpu_percent
+            else 0.0,
+            memory_total_mb=virtual_mem.total // MB,
+            memory_used_mb=virtual_mem.used // MB,
+            per_cpu_percent=per_cpu_percent,
+            top_processes=self._top_processes(),
+        )
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            sample = self._sample()
+            with self._lock:
+                self.samples.append(sample)
+            self._first_sample.set()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Prime the CPU counters, the first readings are measured from here
+            psutil.cpu_percent(percpu=True)
+            self._thread = threading.Thread(
+                target=self._run, name="system-metrics-sampler", daemon=True
+            )
+            self._thread.start()
+
+    def latest(self, max_staleness: float | None = None) -> MetricsSample:
+        """Returns the latest sample, or a fresh one if it is older than max_staleness seconds."""
+        self.start()
+        self._first_sample.wait()
+        max_staleness = self.max_staleness if max_staleness is None else max_staleness
+        with self._lock:
+            sample = self.samples[-1]
+            if time.time() - sample.timestamp > max_staleness:
+                sample = self._sample()
+                self.samples.append(sample)
+        return sample
+
+    def window(self) -> list[MetricsSample]:
+        self.start()
+        with self._lock:
+            return list(self.samples)
+
+    def query(self, per_cpu: bool = False, top_processes: int = 0) -> dict:
+        """Returns the requested metrics, all from the same sample.
+
+        At most ``max_top_processes`` processes are returned.
+        """
+        sample = self.latest()
+        window = self.window()
+        result = {
+            "timestamp": sample.timestamp,
+            "cpu_percent": sample.cpu_percent,
+            "cpu_percent_window_avg": sum(s.cpu_percent for s in window) / len(window),
+            "memory_total_mb": sample.memory_total_mb,
+            "memory_used_mb": sample.memory_used_mb,
+        }
+        if per_cpu:
+            result["per_cpu_percent"] = sample.per_cpu_percent
+        if top_processes > 0:
+            result["top_processes"] = sample.top_processes[:top_processes]
+        return result
+
+
+metrics_provider = SystemMetricsProvider()
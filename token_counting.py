@@ -0,0 +1,27 @@
+from functools import lru_cache
+
+import tiktoken
+
+# Poe does not expose the tokenizers of the models it serves, so counts are
+# approximations based on a generic encoding.
+DEFAULT_ENCODING = "cl100k_base"
+# Rough number of characters per token, used when the encoding is not available
+# (tiktoken downloads encodings on first use)
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding | None:
+    try:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
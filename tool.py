@@ -1,7 +1,8 @@
-import psutil
 from pydantic import BaseModel
 from smolagents import Tool, tool
 
+from system_metrics import metrics_provider
+
 
 class System(BaseModel):
     """
@@ -29,14 +30,29 @@ def get_system_info() -> System:
 
     Returns: A System object with the system information.
     """
-    virtual_mem = psutil.virtual_memory()
+    sample = metrics_provider.latest()
     return System(
-        cpu_percent=psutil.cpu_percent(interval=1),
-        memory_total_mb=virtual_mem.total // (1024 * 1024),
-        memory_used_mb=virtual_mem.used // (1024 * 1024),
+        cpu_percent=sample.cpu_percent,
+        memory_total_mb=sample.memory_total_mb,
+        memory_used_mb=sample.memory_used_mb,
     )
 
 
+@tool
+def get_detailed_system_info(per_cpu: bool = False, top_processes: int = 0) -> dict:
+    """
+    Collects system metrics, optionally with per CPU utilization and the processes
+    using the most memory. All the metrics come from the same sample.
+
+    Args:
+        per_cpu: Whether to include the utilization percentage of each CPU.
+        top_processes: Number of processes using the most memory to include, at most 10.
+
+    Returns: A dictionary with the system information.
+    """
+    return metrics_provider.query(per_cpu=per_cpu, top_processes=top_processes)
+
+
 class SystemInfoTool(Tool):
     name = "system_info_tool"
     description = "Gets system information"
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+SERVICE_NAME = "poe-smolagents"
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str | None
+    start_time_ns: int
+    thread_id: int
+    attributes: dict[str, Any] = field(default_factory=dict)
+    end_time_ns: int | None = None
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Base tracer, which records nothing.
+
+    Spans are nested through a context variable, so a span started while another
+    one is open (e.g. the steps of a managed agent run from the code of its
+    manager) becomes its child.
+    """
+
+    def start_span(self, name: str, **attributes) -> Span | None:
+        return None
+
+    def end_span(self, span: Span | None) -> None:
+        pass
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        finally:
+            self.end_span(span)
+
+
+class RecordingTracer(Tracer):
+    """Keeps finished spans in memory, to export them once the run is over."""
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def start_span(self, name: str, **attributes) -> Span:
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+            span_id=os.urandom(8).hex(),
+            parent_span_id=parent.span_id if parent else None,
+            start_time_ns=time.time_ns(),
+            thread_id=threading.get_ident(),
+            attributes=attributes,
+        )
+        self._tokens[span.span_id] = _current_span.set(span)
+        return span
+
+    def end_span(self, span: Span | None) -> None:
+        if span is None or span.end_time_ns is not None:
+            return
+        span.end_time_ns = time.time_ns()
+        token = self._tokens.pop(span.span_id, None)
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # Ended from another context, e.g. another thread
+                pass
+        with self._lock:
+            self.spans.append(span)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Exports the spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": span.name,
+                    "cat": span.name.split(".")[0],
+                    "ph": "X",
+                    "ts": span.start_time_ns / 1000,
+                    "dur": (span.end_time_ns - span.start_time_ns) / 1000,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": span.attributes,
+                }
+                for span in self.spans
+            ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events}, file, default=str)
+
+    def export_otlp_json(self, path: str) -> None:
+        """Exports the spans as an OTLP/JSON trace export request."""
+        with self._lock:
+            spans = [
+                {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **(
+                        {"parentSpanId": span.parent_span_id}
+                        if span.parent_span_id
+                        else {}
+                    ),
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_time_ns),
+                    "endTimeUnixNano": str(span.end_time_ns),
+                    "attributes": [
+                        _to_otlp_attribute(key, value)
+                        for key, value in span.attributes.items()
+                    ],
+                }
+                for span in self.spans
+            ]
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_to_otlp_attribute("service.name", SERVICE_NAME)]
+                    },
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(request, file)
+
+    def export(self, path: str) -> None:
+        """Exports as OTLP/JSON if the file name ends with .otlp.json, as a Chrome trace otherwise."""
+        if path.endswith(".otlp.json"):
+            self.export_otlp_json(path)
+        else:
+            self.export_chrome_trace(path)
+
+
+def _to_otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        otlp_value = {"boolValue": value}
+    elif isinstance(value, int):
+        otlp_value = {"intValue": str(value)}
+    elif isinstance(value, float):
+        otlp_value = {"doubleValue": value}
+    else:
+        otlp_value = {"stringValue": str(value)}
+    return {"key": key, "value": otlp_value}
+
+
+_tracer: Tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    global _tracer
+    _tracer = tracer
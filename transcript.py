@@ -0,0 +1,169 @@
+import ast
+import heapq
+import json
+import weakref
+from collections.abc import Iterator
+from typing import TextIO
+
+from smolagents import (
+    ActionStep,
+    AgentLogger,
+    ChatMessage,
+    LogLevel,
+    MemoryStep,
+    MessageRole,
+    MultiStepAgent,
+    ToolCall,
+)
+
+TOOLS_LOG_PREFIX = "Calling tools:\n"
+
+
+def _render_tool_calls(tool_calls: list[ToolCall]) -> str:
+    rendered = []
+    for tool_call in tool_calls:
+        rendered.append(f"Function: {tool_call.name}\nArguments:\n")
+        if isinstance(tool_call.arguments, dict):
+            for k, v in tool_call.arguments.items():
+                rendered.append(f"\t{k}: {v}\n")
+        else:
+            rendered.append(str(tool_call.arguments))
+    return "".join(rendered)
+
+
+def _extract_log(content: str, logger: AgentLogger) -> str:
+    if content.startswith(TOOLS_LOG_PREFIX):
+        tools = content.split(TOOLS_LOG_PREFIX)[-1]
+        try:
+            content = _render_tool_calls(
+                [
+                    ToolCall(
+                        name=t.get("function", {}).get("name", ""),
+                        arguments=t.get("function", {}).get("arguments", {}),
+                        id=t.get("id", ""),
+                    )
+                    for t in ast.literal_eval(tools)
+                ]
+            )
+        except (ValueError, SyntaxError) as error:
+            logger.log(
+                f"Error extracting tool log.\nContent: {content}\n Error: {error}",
+                level=LogLevel.ERROR,
+            )
+
+    return content
+
+
+# Contents extracted with _extract_log, per step, so repeated exports of the same
+# steps do not parse them again
+_extracted_logs: dict[int, dict[str, str]] = {}
+
+
+def _extract_step_log(step: MemoryStep, content: str, logger: AgentLogger) -> str:
+    if not content.startswith(TOOLS_LOG_PREFIX):
+        return content
+    step_logs = _extracted_logs.get(id(step))
+    if step_logs is None:
+        step_logs = _extracted_logs[id(step)] = {}
+        weakref.finalize(step, _extracted_logs.pop, id(step), None)
+    if content not in step_logs:
+        step_logs[content] = _extract_log(content, logger)
+    return step_logs[content]
+
+
+def _get_message_contents(
+    step: MemoryStep, message: ChatMessage, logger: AgentLogger
+) -> list[str]:
+    if (
+        message.role == MessageRole.TOOL_CALL
+        and isinstance(step, ActionStep)
+        and step.tool_calls
+    ):
+        return [_render_tool_calls(step.tool_calls)]
+    # Fall back to parsing the text of the message
+    return [
+        _extract_step_log(step, e["text"], logger)
+        for e in message.content
+        if "text" in e
+    ]
+
+
+def iter_agents(agent: MultiStepAgent) -> Iterator[MultiStepAgent]:
+    """Yields the agent and all its managed agents, recursively."""
+    yield agent
+    for managed_agent in agent.managed_agents.values():
+        yield from iter_agents(managed_agent)
+
+
+def _iter_keyed_steps(
+    agent: MultiStepAgent, agent_index: int
+) -> Iterator[tuple[tuple[float, int, int], str, MemoryStep]]:
+    agent_name = agent.name if agent.name else "unnamed_agent"
+    # Steps without timing (e.g. task steps) are kept in place, using the start time
+    # of the previous step, so the keys of each agent never decrease
+    start_time = 0.0
+    for step_index, step in enumerate(agent.memory.steps):
+        timing = getattr(step, "timing", None)
+        start_time = getattr(timing, "start_time", None) or start_time
+        yield (start_time, agent_index, step_index), agent_name, step
+
+
+def iter_all_memory_steps(
+    manager_agent: MultiStepAgent,
+) -> Iterator[tuple[str, MemoryStep]]:
+    """Yields (agent name, step) for the steps of all agents, ordered by start time.
+
+    The steps of each agent are already time-ordered, so they are k-way merged
+    rather than collected and sorted.
+    """
+    for _, agent_name, step in heapq.merge(
+        *(
+            _iter_keyed_steps(agent, agent_index)
+            for agent_index, agent in enumerate(iter_agents(manager_agent))
+        ),
+        key=lambda keyed_step: keyed_step[0],
+    ):
+        yield agent_name, step
+
+
+def iter_message_records(manager_agent: MultiStepAgent) -> Iterator[dict]:
+    for agent_name, step in iter_all_memory_steps(manager_agent):
+        for message in step.to_messages():
+            yield {
+                "agent": agent_name,
+                "role": message.role.value,
+                "contents": _get_message_contents(step, message, manager_agent.logger),
+            }
+
+
+def format_message_record(record: dict) -> str:
+    return "".join(
+        [
+            f"Agent: {record['agent'].upper()}\n",
+            f"Role: {record['role'].upper()}\n",
+            "------------------\n",
+            "\n".join(record["contents"]),
+            "\n==================\n\n",
+        ]
+    )
+
+
+def iter_exported_messages(manager_agent: MultiStepAgent) -> Iterator[str]:
+    for record in iter_message_records(manager_agent):
+        yield format_message_record(record)
+
+
+def get_all_messages(manager_agent: MultiStepAgent) -> list[str]:
+    return list(iter_exported_messages(manager_agent))
+
+
+def export_messages_text(manager_agent: MultiStepAgent, sink: TextIO) -> None:
+    for message in iter_exported_messages(manager_agent):
+        sink.write(message)
+        sink.write("\n")
+
+
+def export_messages_jsonl(manager_agent: MultiStepAgent, sink: TextIO) -> None:
+    for record in iter_message_records(manager_agent):
+        sink.write(json.dumps(record, default=str))
+        sink.write("\n")
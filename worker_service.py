@@ -0,0 +1,387 @@
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from smolagents import LocalPythonExecutor, MultiStepAgent
+
+from args import add_compaction_arguments, add_model_arguments
+from batch_query import build_agent, run_agent
+from events import AgentEvent, CallbackSink
+from ledger import setup_ledger
+
+
+def reset_agent(agent: MultiStepAgent) -> None:
+    """Clears what the previous run left in an agent, so that it can run another job.
+
+    The memory is reset by the run itself, the variables of the run and of its
+    executor are cleared here, and the ledger restarts from scratch.
+    """
+    agent.state.clear()
+    python_executor = getattr(agent, "python_executor", None)
+    if isinstance(python_executor, LocalPythonExecutor):
+        python_executor.state = {"__name__": "__main__"}
+        python_executor.custom_tools = {}
+    for managed_agent in agent.managed_agents.values():
+        reset_agent(managed_agent)
+    setup_ledger(agent)
+
+
+class AgentWorker:
+    """Runs jobs one at a time, on agents kept warm across jobs.
+
+    Agents are built once per kind of job (model, agent type, tools, streaming),
+    with their model, tools and executor, and reset between jobs. The events of
+    each job are sent to ``result_queue`` as JSON lines, followed by None.
+    """
+
+    def __init__(self, result_queue, service_args):
+        self.result_queue = result_queue
+        self.service_args = service_args
+        self.agents: dict[tuple, MultiStepAgent] = {}
+        self.job_id: str | None = None
+
+    def _send_event(self, event: AgentEvent) -> None:
+        self.result_queue.put((self.job_id, json.dumps(event.dict(), default=str)))
+
+    def get_agent(self, job: dict) -> MultiStepAgent:
+        key = (
+            job["model_id"],
+            job.get("agent_type", "code"),
+            tuple(job.get("tools", [])),
+            job.get("stream_outputs", True),
+        )
+        if key not in self.agents:
+            self.agents[key] = build_agent(
+                job,
+                self.service_args,
+                stream_outputs=job.get("stream_outputs", True),
+                event_sink=CallbackSink(self._send_event),
+            )
+        else:
+            reset_agent(self.agents[key])
+        return self.agents[key]
+
+    def run_job(self, job_id: str, job: dict) -> None:
+        self.job_id = job_id
+        result = run_agent(lambda: self.get_agent(job), job)
+        self._send_event(
+            AgentEvent(type="result", agent_name=None, step_number=None, data=result)
+        )
+        self.result_queue.put((job_id, None))
+        self.job_id = None
+
+
+def failed_job_result(job: dict, error: str) -> AgentEvent:
+    """Returns the result event of a job which could not run to its end."""
+    return AgentEvent(
+        type="result",
+        agent_name=None,
+        step_number=None,
+        data={**job, "output": None, "state": "error", "error": error},
+    )
+
+
+def worker_main(job_queue, result_queue, service_args, preload_jobs: list[dict]):
+    worker = AgentWorker(result_queue, service_args)
+    for job in preload_jobs:
+        worker.get_agent(job)
+    while (item := job_queue.get()) is not None:
+        worker.run_job(*item)
+
+
+class WorkerService:
+    """Local HTTP service running agent jobs on a pool of warm worker processes.
+
+    ``POST /jobs`` with a JSON job, in the format of the batch_query rows (task,
+    model_id, agent_type, max_steps, tools) and optionally stream_outputs, answers
+    with the events of the job as they happen, one JSON line per event, ending
+    with a "result" event. ``GET /health`` gives the number of workers and jobs.
+
+    The workers import everything and build their agents once (``preload_jobs``
+    builds them before the first job), so jobs only pay for their model calls and
+    code execution, and run in parallel across processes.
+
+    Jobs are handed to idle workers one at a time. A worker which dies (e.g. out of
+    memory) fails the job it was running with an "error" and a "result" event, and
+    is replaced by a new worker. A job handed to the worker which it never took,
+    e.g. as it died idle, is handed to the next idle worker instead. Workers are started from a fork server, so the
+    scripts creating a service must guard their entry point with
+    ``if __name__ == "__main__"``.
+    """
+
+    def __init__(
+        self,
+        service_args,
+        workers: int = 1,
+        preload_jobs: list[dict] | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.service_args = service_args
+        self.workers = workers
+        self.preload_jobs = preload_jobs or []
+        self.worker_restarts = 0
+        # Workers are forked from a server which imported everything, rather than
+        # from the service, whose threads may hold locks when a worker is replaced
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(["batch_query"])
+        self._result_queue = self._context.Queue()
+        self._processes: list[multiprocessing.Process | None] = [None] * workers
+        self._job_queues: list[multiprocessing.Queue | None] = [None] * workers
+        # The job run by each worker, by id
+        self._worker_jobs: list[tuple[str, dict] | None] = [None] * workers
+        # Workers which died and are being replaced, which get no job
+        self._dead_workers: set[int] = set()
+        self._pending_jobs: deque[tuple[str, dict]] = deque()
+        self._jobs: dict[str, queue.Queue] = {}
+        self._jobs_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _start_worker(self, index: int) -> None:
+        job_queue = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main,
+            args=(job_queue, self._result_queue, self.service_args, self.preload_jobs),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._job_queues[index] = job_queue
+        self._processes[index] = process
+
+    def start(self) -> "WorkerService":
+        for index in range(self.workers):
+            self._start_worker(index)
+        for target, name in (
+            (self._dispatch_events, "worker-service-events"),
+            (self._monitor_workers, "worker-service-monitor"),
+            (self._server.serve_forever, "worker-service-http"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+        for job_queue in self._job_queues:
+            job_queue.put(None)
+        for process in self._processes:
+            process.join()
+        self._result_queue.put(None)
+
+    def __enter__(self) -> "WorkerService":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def submit(self, job: dict) -> queue.Queue:
+        """Queues a job, and returns the queue of its JSON events, ending with None."""
+        job_id = uuid.uuid4().hex
+        events = queue.Queue()
+        with self._jobs_lock:
+            self._jobs[job_id] = events
+            self._pending_jobs.append((job_id, job))
+            self._assign_jobs()
+        return events
+
+    def _assign_jobs(self) -> None:
+        # Called with the jobs lock held
+        for index, worker_job in enumerate(self._worker_jobs):
+            if not self._pending_jobs:
+                return
+            if worker_job is None and index not in self._dead_workers:
+                self._worker_jobs[index] = self._pending_jobs.popleft()
+                self._job_queues[index].put(self._worker_jobs[index])
+
+    def _dispatch_events(self) -> None:
+        while (item := self._result_queue.get()) is not None:
+            job_id, line = item
+            with self._jobs_lock:
+                # The job may have been failed already, if its worker died
+                events = self._jobs.get(job_id)
+                if line is None:
+                    self._jobs.pop(job_id, None)
+                    for index, worker_job in enumerate(self._worker_jobs):
+                        if worker_job is not None and worker_job[0] == job_id:
+                            self._worker_jobs[index] = None
+                    self._assign_jobs()
+            if events is not None:
+                events.put(line)
+
+    def _monitor_workers(self) -> None:
+        while not self._stopping.is_set():
+            sentinels = {
+                process.sentinel: index for index, process in enumerate(self._processes)
+            }
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=1):
+                if self._stopping.is_set():
+                    return
+                self._replace_worker(sentinels[sentinel])
+
+    def _job_started(self, index: int) -> bool:
+        """Whether the dead worker took its job from its queue."""
+        try:
+            return self._job_queues[index].qsize() == 0
+        except NotImplementedError:
+            # qsize is not available on macOS, the job is assumed to have started
+            return True
+
+    def _replace_worker(self, index: int) -> None:
+        with self._jobs_lock:
+            # The worker may have died idle, no job is handed to it anymore
+            self._dead_workers.add(index)
+        exitcode = self._processes[index].exitcode
+        self._processes[index].join()
+        with self._jobs_lock:
+            worker_job = self._worker_jobs[index]
+            self._worker_jobs[index] = None
+            # A job which never started is run by another worker instead
+            if worker_job is not None and not self._job_started(index):
+                self._pending_jobs.appendleft(worker_job)
+                worker_job = None
+        self._start_worker(index)
+        with self._jobs_lock:
+            self.worker_restarts += 1
+            self._dead_workers.discard(index)
+            events = self._jobs.pop(worker_job[0], None) if worker_job else None
+            self._assign_jobs()
+        if events is not None:
+            error = f"The worker running the job exited with code {exitcode}"
+            for event in (
+                AgentEvent(
+                    type="error",
+                    agent_name=None,
+                    step_number=None,
+                    data={"error": error},
+                ),
+                failed_job_result(worker_job[1], error),
+            ):
+                events.put(json.dumps(event.dict(), default=str))
+            events.put(None)
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.path != "/health":
+                    self.send_error(404)
+                    return
+                with service._jobs_lock:
+                    jobs = len(service._jobs)
+                self._send_json(
+                    200,
+                    {
+                        "workers": service.workers,
+                        "jobs": jobs,
+                        "worker_restarts": service.worker_restarts,
+                    },
+                )
+
+            def do_POST(self):
+                if self.path != "/jobs":
+                    self.send_error(404)
+                    return
+                content_length = self.headers.get("Content-Length")
+                if content_length is None:
+                    self._send_json(411, {"error": "Missing Content-Length"})
+                    return
+                try:
+                    job = json.loads(self.rfile.read(int(content_length)))
+                    missing = [key for key in ("task", "model_id") if key not in job]
+                    if missing:
+                        raise ValueError(f"Missing {', '.join(missing)}")
+                except ValueError as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                events = service.submit(job)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    while (line := events.get()) is not None:
+                        self._write_chunk((line + "\n").encode())
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The job still runs to the end, its events are dropped
+                    self.close_connection = True
+
+            def _send_json(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve agent jobs over HTTP from warm worker processes, streaming their events."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes, i.e. of jobs run in parallel",
+    )
+    parser.add_argument(
+        "--preload",
+        type=str,
+        default=None,
+        help="JSONL file of jobs (without task) whose agents are built when the workers start",
+    )
+    add_model_arguments(parser)
+    add_compaction_arguments(parser)
+    service_args = parser.parse_args()
+
+    preload_jobs = []
+    if service_args.preload:
+        with open(service_args.preload, encoding="utf-8") as preload_file:
+            preload_jobs = [json.loads(line) for line in preload_file if line.strip()]
+    with WorkerService(
+        service_args,
+        workers=service_args.workers,
+        preload_jobs=preload_jobs,
+        host=service_args.host,
+        port=service_args.port,
+    ) as service:
+        print(f"Serving agent jobs on {service.url}/jobs")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
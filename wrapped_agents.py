@@ -1,39 +1,64 @@
-import ast
 import json
 import os
 import re
+import time
+import uuid
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from contextvars import copy_context
 from copy import deepcopy
+from threading import Lock
 from typing import Any
 
 from dotenv import load_dotenv
-from rich.console import Group
-from rich.live import Live
-from rich.markdown import Markdown
-from rich.text import Text
 from smolagents import (
     CODEAGENT_RESPONSE_FORMAT,
     ActionOutput,
     ActionStep,
+    AgentAudio,
     AgentExecutionError,
     AgentGenerationError,
+    AgentImage,
     AgentParsingError,
+    AgentToolExecutionError,
     ChatMessage,
     ChatMessageStreamDelta,
     CodeAgent,
-    LogLevel,
-    MemoryStep,
+    LocalPythonExecutor,
+    Model,
     MultiStepAgent,
-    OpenAIServerModel,
+    PlanningStep,
     ToolCall,
     ToolCallingAgent,
     ToolOutput,
-    agglomerate_stream_deltas,
     fix_final_answer_code,
     models,
     parse_code_blobs,
-    truncate_content,
+    parse_json_if_needed,
 )
+from smolagents.local_python_executor import DEFAULT_MAX_LEN_OUTPUT
+
+from checkpoint import SessionCheckpoint
+from context_compaction import ContextCompactor
+from delegation_cache import DelegationCache
+from events import AgentEvent, ConsoleSink, EventSink
+from json_repair import ParsingRecoveryStats, repair_json
+from ledger import setup_ledger
+from message_builder import IncrementalMessageBuilder
+from model_cache import CachedModel
+from model_registry import model_registry
+from model_router import ModelRouter, parse_model_ids
+from observation_capture import ObservationCapture
+from resilient_models import ResilientModel, RetryPolicy
+from speculative_execution import (
+    CodeBlockDetector,
+    SpeculationStats,
+    SpeculativeExecution,
+)
+from streaming import StreamAccumulator
+from tracing import Span, get_tracer
 
 load_dotenv()
 
@@ -45,110 +70,420 @@ if not POE_BASE_URL:
     raise ValueError("Could not find POE_BASE_URL variable in the environment")
 
 
-def get_agent_model(model_id: str) -> OpenAIServerModel:
-    return OpenAIServerModel(
-        model_id=model_id, api_base=POE_BASE_URL, api_key=POE_API_KEY
+def get_agent_model(
+    model_id: str,
+    cache_dir: str | None = None,
+    cache_mode: str = "record",
+    max_retries: int = 3,
+    hedge: bool = False,
+    router_stats_path: str | None = None,
+) -> Model:
+    # Several model ids, e.g. "Kimi-K2:2,GPT-5", are routed (see ModelRouter)
+    if "," in model_id:
+        weights = parse_model_ids(model_id)
+        model = ModelRouter(
+            [
+                get_agent_model(routed_model_id, max_retries=max_retries, hedge=hedge)
+                for routed_model_id in weights
+            ],
+            weights=list(weights.values()),
+            stats_path=router_stats_path,
+        )
+        if cache_dir:
+            model = CachedModel(model, cache_dir=cache_dir, mode=cache_mode)
+        return model
+
+    # Shared by all the agents, see ModelRegistry
+    model = model_registry.get(model_id, base_url=POE_BASE_URL, api_key=POE_API_KEY)
+    model = ResilientModel(
+        model, retry_policy=RetryPolicy(max_retries=max_retries), hedge=hedge
     )
+    if cache_dir:
+        model = CachedModel(model, cache_dir=cache_dir, mode=cache_mode)
+    return model
 
 
-TOOLS_LOG_PREFIX = "Calling tools:\n"
+@property
+def total_input_tokens(self) -> int:
+    # Wrapped agents keep running totals of their agent tree
+    ledger = getattr(self, "ledger", None)
+    if ledger is not None:
+        return ledger.tree_totals.input_tokens
+    managed_agents_count = [
+        agent.total_input_tokens for agent in self.managed_agents.values()
+    ]
+    return sum(managed_agents_count) + self.monitor.total_input_token_count
 
 
-def _extract_log(content: str) -> str:
-    if content.startswith(TOOLS_LOG_PREFIX):
-        tools = content.split(TOOLS_LOG_PREFIX)[-1]
-        new_content = ""
-        try:
-            for t in ast.literal_eval(tools):
-                function = t.get("function", {}).get("name", "")
-                new_content += f"Function: {function}\nArguments:\n"
-                arguments = t.get("function", {}).get("arguments", {})
-                if isinstance(arguments, dict):
-                    for k, v in arguments.items():
-                        new_content += f"\t{k}: {v}\n"
-                else:
-                    new_content += arguments
-            content = new_content
-        except (ValueError, SyntaxError) as error:
-            print(f"Error extracting tool log.\nContent: {content}\n Error: {error}")
+_multi_step_agent_call = MultiStepAgent.__call__
 
-    return content
 
+def traced_call(self, task: str, **kwargs):
+    # Calls of managed agents by their manager
+    with get_tracer().span("agent.managed_agent_call", agent=self.name):
+        return _multi_step_agent_call(self, task, **kwargs)
 
-def _sort_memory_steps(steps: list[MemoryStep]) -> list[MemoryStep]:
-    def _get_start_time(step):
-        timing = getattr(step, "timing", None)
-        return getattr(timing, "start_time", None)
 
-    return sorted(
-        steps,
-        key=lambda step: (
-            _get_start_time(step) is not None,
-            _get_start_time(step) or 0,
-        ),
+def cached_call(self, task: str, **kwargs):
+    # Repeated delegations are answered from the cache of the manager, if any
+    delegation_cache: DelegationCache | None = getattr(
+        self, "manager_delegation_cache", None
     )
+    if delegation_cache is None:
+        return traced_call(self, task, **kwargs)
+    key = delegation_cache.key(self.name, task, kwargs)
+    answer = delegation_cache.get(key)
+    if answer is not None:
+        with get_tracer().span(
+            "agent.managed_agent_call", agent=self.name, cached=True
+        ):
+            return answer
+    answer = traced_call(self, task, **kwargs)
+    delegation_cache.put(key, self, answer)
+    return answer
 
 
-def get_all_messages(manager_agent: MultiStepAgent) -> list[str]:
-    all_steps = manager_agent.all_memory_steps
-    sorted_steps = _sort_memory_steps(all_steps)
+def report_parse_error(model: Model) -> None:
+    # Lets routers (see ModelRouter) avoid the model for the next call
+    if hasattr(model, "report_parse_error"):
+        model.report_parse_error()
 
-    all_messages = []
-    for step in sorted_steps:
-        messages = step.to_messages()
-        all_messages.append({step.agent_name: messages})
 
-    exported_messages = []
-    for messages in all_messages:
-        for agent_name, agent_messages in messages.items():
-            for agent_message in agent_messages:
-                role = agent_message.role.value.upper()
-                contents = [_extract_log(e["text"]) for e in agent_message.content]
-                str = f"Agent: {agent_name.upper()}\n"
-                str += f"Role: {role}\n"
-                str += "------------------\n"
-                str += "\n".join(contents)
-                str += "\n==================\n\n"
-                exported_messages.append(str)
+def emit_event(
+    agent: MultiStepAgent, event_type: str, step_number: int | None, **data
+) -> None:
+    agent.event_sink.emit(
+        AgentEvent(
+            type=event_type, agent_name=agent.name, step_number=step_number, data=data
+        )
+    )
 
-    return exported_messages
 
+MultiStepAgent.total_input_tokens = total_input_tokens
+MultiStepAgent.__call__ = cached_call
 
-@property
-def total_input_tokens(self) -> int:
-    managed_agents_count = [
-        agent.total_input_tokens for agent in self.managed_agents.values()
-    ]
-    return sum(managed_agents_count) + self.monitor.total_input_token_count
 
+class AgentInstrumentationMixin:
+    """Instrumentation shared by the wrapped agents.
 
-@property
-def all_memory_steps(self) -> dict[str, list[MemoryStep]]:
-    # Get managed agents steps
-    managed_agent_steps = [
-        step
-        for agent in self.managed_agents.values()
-        for step in agent.all_memory_steps
-    ]
+    Sets up the ledger, the event sink, the incremental message builder with its
+    optional compactor, the delegation cache and the session checkpoint, and
+    records each step once it is finalized.
+    """
+
+    def __init__(
+        self,
+        *args,
+        context_compactor: ContextCompactor | None = None,
+        event_sink: EventSink | None = None,
+        delegation_cache: DelegationCache | None = None,
+        session_checkpoint: SessionCheckpoint | None = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        setup_ledger(self)
+        self._step_span: Span | None = None
+        self.message_builder = IncrementalMessageBuilder()
+        self.context_compactor = context_compactor
+        # Without a sink, events are rendered to the console
+        self.event_sink = event_sink or self._console_sink()
+        self.delegation_cache = delegation_cache
+        if delegation_cache is not None:
+            delegation_cache.attach(self)
+            self.delegation_cache_stats = delegation_cache.stats
+        # Resumes the session of the agent tree if the checkpoint has one
+        self.session_checkpoint = None
+        if session_checkpoint is not None:
+            session_checkpoint.attach(self)
+
+    def _console_sink(self) -> ConsoleSink:
+        return ConsoleSink(self.logger)
+
+    def write_memory_to_messages(self, summary_mode: bool = False) -> list[ChatMessage]:
+        if summary_mode:
+            return super().write_memory_to_messages(summary_mode=summary_mode)
+        messages = self.message_builder.build(self.memory)
+        if self.context_compactor is not None:
+            messages, saved_tokens = self.context_compactor.compact(
+                self.message_builder
+            )
+            if self.ledger.current_step_timer is not None:
+                self.ledger.current_step_timer.compacted_tokens += saved_tokens
+        return messages
+
+    def _finalize_step(self, memory_step: ActionStep | PlanningStep):
+        super()._finalize_step(memory_step)
+        record = self.ledger.record_step(memory_step)
+        step_number = getattr(memory_step, "step_number", None)
+        if isinstance(memory_step, ActionStep) and memory_step.error is not None:
+            emit_event(self, "error", step_number, error=str(memory_step.error))
+        emit_event(self, "stats", step_number, record=record)
+        if self.session_checkpoint is not None:
+            self.session_checkpoint.sync(self, memory_step)
+        if isinstance(memory_step, ActionStep):
+            get_tracer().end_span(self._step_span)
+            self._step_span = None
+
+
+class WrappedToolCallingAgent(AgentInstrumentationMixin, ToolCallingAgent):
+    def __init__(
+        self,
+        *args,
+        parallel_tool_calls: bool = True,
+        tool_call_timeout: float | None = None,
+        **kwargs,
+    ):
+        self.parallel_tool_calls = parallel_tool_calls
+        self.tool_call_timeout = tool_call_timeout
+        super().__init__(*args, **kwargs)
+
+    def _step_stream(
+        self, memory_step: ActionStep
+    ) -> Generator[ChatMessageStreamDelta | ToolCall | ToolOutput | ActionOutput]:
+        """
+        Perform one step in the ReAct framework: the agent thinks, acts, and observes the result.
+        Yields ChatMessageStreamDelta during the run if streaming is enabled.
+        At the end, yields either None if the step is not final, or the final answer.
+        """
+        step_timer = self.ledger.start_step()
+        self._step_span = get_tracer().start_span(
+            "agent.step", agent=self.name, step_number=memory_step.step_number
+        )
+        memory_messages = self.write_memory_to_messages()
 
-    # Get own steps and tag with name
-    agent_name = self.name if self.name else "unnamed_agent"
-    steps = self.memory.steps
-    for step in steps:
-        setattr(step, "agent_name", agent_name)
+        input_messages = memory_messages.copy()
 
-    return steps + managed_agent_steps
+        # Add new step in logs
+        memory_step.model_input_messages = input_messages
 
+        generation_start_time = time.time()
+        try:
+            if self.stream_outputs and hasattr(self.model, "generate_stream"):
+                output_stream = self.model.generate_stream(
+                    input_messages,
+                    stop_sequences=["Observation:", "Calling tools:"],
+                    tools_to_call_from=self.tools_and_managed_agents,
+                )
 
-MultiStepAgent.total_input_tokens = total_input_tokens
-MultiStepAgent.all_memory_steps = all_memory_steps
+                # UPDATED: fold deltas incrementally and send them to the event sink,
+                # which renders them (see ConsoleSink) or not.
+                # BEFORE:
+                # chat_message_stream_deltas.append(event)
+                # live.update(Markdown(agglomerate_stream_deltas(chat_message_stream_deltas).render_as_markdown()))
+                # AFTER:
+                stream_accumulator = StreamAccumulator()
+                for event in output_stream:
+                    stream_accumulator.add(event)
+                    if event.content or event.tool_calls:
+                        step_timer.mark_first_token(generation_start_time)
+                    emit_event(self, "delta", memory_step.step_number, delta=event)
+                    yield event
+                chat_message = stream_accumulator.to_chat_message()
+                # -------
+                streamed = True
+            else:
+                chat_message: ChatMessage = self.model.generate(
+                    input_messages,
+                    stop_sequences=["Observation:", "Calling tools:"],
+                    tools_to_call_from=self.tools_and_managed_agents,
+                )
+                streamed = False
+            if chat_message.content is None and chat_message.raw is not None:
+                log_content = str(chat_message.raw)
+            else:
+                log_content = str(chat_message.content) or ""
+            emit_event(
+                self,
+                "model_output",
+                memory_step.step_number,
+                content=log_content,
+                streamed=streamed,
+            )
 
+            # Record model output
+            memory_step.model_output_message = chat_message
+            memory_step.model_output = chat_message.content
+            memory_step.token_usage = chat_message.token_usage
+        except Exception as e:
+            raise AgentGenerationError(
+                f"Error while generating output:\n{e}", self.logger
+            ) from e
+
+        if chat_message.tool_calls is None or len(chat_message.tool_calls) == 0:
+            try:
+                chat_message = self.model.parse_tool_calls(chat_message)
+            except Exception as e:
+                report_parse_error(self.model)
+                raise AgentParsingError(
+                    f"Error while parsing tool call from model output: {e}", self.logger
+                )
+        else:
+            for tool_call in chat_message.tool_calls:
+                tool_call.function.arguments = parse_json_if_needed(
+                    tool_call.function.arguments
+                )
+        # Includes the parsing of the tool calls
+        step_timer.generation_time = time.time() - generation_start_time
+        final_answer, got_final_answer = None, False
+        for output in self.process_tool_calls(chat_message, memory_step):
+            yield output
+            if isinstance(output, ToolOutput):
+                if output.is_final_answer:
+                    if len(chat_message.tool_calls) > 1:
+                        raise AgentExecutionError(
+                            "If you want to return an answer, please do not perform any other tool calls than the final answer tool call!",
+                            self.logger,
+                        )
+                    if got_final_answer:
+                        raise AgentToolExecutionError(
+                            "You returned multiple final answers. Please return only one single final answer!",
+                            self.logger,
+                        )
+                    final_answer = output.output
+                    got_final_answer = True
+
+                    # Manage state variables
+                    if (
+                        isinstance(final_answer, str)
+                        and final_answer in self.state.keys()
+                    ):
+                        final_answer = self.state[final_answer]
+        if got_final_answer:
+            emit_event(
+                self, "final_answer", memory_step.step_number, output=final_answer
+            )
+        yield ActionOutput(
+            output=final_answer,
+            is_final_answer=got_final_answer,
+        )
+
+    def _process_single_tool_call(self, tool_call: ToolCall) -> ToolOutput:
+        tool_name = tool_call.name
+        tool_arguments = tool_call.arguments or {}
+        emit_event(
+            self,
+            "tool_call",
+            self.step_number,
+            id=tool_call.id,
+            name=tool_name,
+            arguments=tool_arguments,
+        )
+        tool_call_result = self.execute_tool_call(tool_name, tool_arguments)
+        tool_call_result_type = type(tool_call_result)
+        if tool_call_result_type in [AgentImage, AgentAudio]:
+            if tool_call_result_type == AgentImage:
+                observation_name = "image.png"
+            elif tool_call_result_type == AgentAudio:
+                observation_name = "audio.mp3"
+            self.state[observation_name] = tool_call_result
+            observation = f"Stored '{observation_name}' in memory."
+        else:
+            observation = str(tool_call_result).strip()
+        emit_event(
+            self,
+            "observation",
+            self.step_number,
+            tool_call_id=tool_call.id,
+            tool_name=tool_name,
+            observation=observation,
+        )
+        return ToolOutput(
+            id=tool_call.id,
+            output=tool_call_result,
+            is_final_answer=tool_name == "final_answer",
+            observation=observation,
+            tool_call=tool_call,
+        )
+
+    def process_tool_calls(
+        self, chat_message: ChatMessage, memory_step: ActionStep
+    ) -> Generator[ToolCall | ToolOutput]:
+        """
+        Same as ToolCallingAgent.process_tool_calls, which runs tool calls in
+        parallel, but they run sequentially if `parallel_tool_calls` is unset, and
+        outputs are always yielded and written to memory in the order of the calls.
+
+        A managed agent whose call times out is interrupted before its next step,
+        while a tool call which times out keeps running in the background.
+        """
+        assert chat_message.tool_calls is not None
+        tool_calls = []
+        for chat_tool_call in chat_message.tool_calls:
+            tool_call = ToolCall(
+                name=chat_tool_call.function.name,
+                arguments=chat_tool_call.function.arguments,
+                id=chat_tool_call.id,
+            )
+            yield tool_call
+            tool_calls.append(tool_call)
+
+        tool_outputs = []
+        executor_start_time = time.time()
+        if not self.parallel_tool_calls or len(tool_calls) == 1:
+            for tool_call in tool_calls:
+                tool_output = self._process_single_tool_call(tool_call)
+                tool_outputs.append(tool_output)
+                yield tool_output
+        else:
+            # A managed agent can not run several tasks at once, since it has a single memory
+            managed_agent_locks = {name: Lock() for name in self.managed_agents}
+            start_times: dict[int, float] = {}
+
+            def process_tool_call(index: int, tool_call: ToolCall) -> ToolOutput:
+                lock = managed_agent_locks.get(tool_call.name) or nullcontext()
+                with lock:
+                    start_times[index] = time.time()
+                    return self._process_single_tool_call(tool_call)
+
+            executor = ThreadPoolExecutor(self.max_tool_threads)
+            try:
+                futures = [
+                    # Copy the context so the spans of the call nest under the step
+                    executor.submit(
+                        copy_context().run, process_tool_call, index, tool_call
+                    )
+                    for index, tool_call in enumerate(tool_calls)
+                ]
+                for index, (tool_call, future) in enumerate(zip(tool_calls, futures)):
+                    tool_output = None
+                    while tool_output is None:
+                        # The timeout of each call starts when the call actually starts
+                        timeout = self.tool_call_timeout
+                        if timeout is not None and index in start_times:
+                            timeout = max(0, start_times[index] + timeout - time.time())
+                        try:
+                            tool_output = future.result(timeout=timeout)
+                        except FutureTimeoutError:
+                            if index in start_times and timeout == 0:
+                                if tool_call.name in self.managed_agents:
+                                    self.managed_agents[tool_call.name].interrupt()
+                                raise AgentToolExecutionError(
+                                    f"Tool call '{tool_call.name}' timed out after {self.tool_call_timeout} seconds.",
+                                    self.logger,
+                                )
+                    tool_outputs.append(tool_output)
+                    yield tool_output
+            finally:
+                # Do not wait for the calls which timed out
+                executor.shutdown(wait=False, cancel_futures=True)
+        if self.ledger.current_step_timer is not None:
+            self.ledger.current_step_timer.executor_time += (
+                time.time() - executor_start_time
+            )
+
+        memory_step.tool_calls = tool_calls
+        memory_step.observations = memory_step.observations or ""
+        for tool_output in tool_outputs:
+            memory_step.observations += tool_output.observation + "\n"
+        memory_step.observations = (
+            memory_step.observations.rstrip("\n")
+            if memory_step.observations
+            else memory_step.observations
+        )
 
-class WrappedToolCallingAgent(ToolCallingAgent):
     def execute_tool_call(self, tool_name: str, arguments: dict[str, str] | str) -> Any:
         # Provide empty additional args if missing, which seems to be a common way
         # for the agent to trip on the tool call
-        print(f"AGENT {self.name}: Calling tool {tool_name} with arguments {arguments}")
         updated_arguments = deepcopy(arguments)
         if (
             tool_name.endswith("agent")
@@ -156,14 +491,16 @@ class WrappedToolCallingAgent(ToolCallingAgent):
             and not updated_arguments.get("additional_args")
         ):
             updated_arguments["additional_args"] = {}
-        return super().execute_tool_call(
-            tool_name=tool_name, arguments=updated_arguments
-        )
+        with get_tracer().span("agent.tool_call", agent=self.name, tool=tool_name):
+            return super().execute_tool_call(
+                tool_name=tool_name, arguments=updated_arguments
+            )
 
 
 # Monkey patch the function which describes whether model supports stop parameters
 # to always return False.
-# This effectively prevents the Poe API call from failing on some models
+# This effectively prevents the Poe API call from failing on some models.
+# Stop sequences are enforced on the client side by PoeServerModel instead.
 models.supports_stop_parameter = lambda model_id: False
 
 
@@ -209,7 +546,87 @@ def extract_internal_structure_text(text: str) -> str:
     return text[start_match.start() :]
 
 
-class WrappedCodeAgent(CodeAgent):
+def parse_structured_code_action(
+    text: str, code_block_tags: tuple[str, str], recovery_stats: ParsingRecoveryStats
+) -> str:
+    """Returns the code of a structured output, recovering it locally if the JSON is malformed.
+
+    A parsing error costs a whole extra step, so before giving up the JSON is
+    repaired (see `repair_json`), and as a last resort the code is taken from a
+    code block of the raw text.
+    """
+    pre_processed_text = extract_internal_structure_text(text)
+    try:
+        return json.loads(pre_processed_text)["code"]
+    except (ValueError, KeyError, TypeError) as e:
+        error = e
+    try:
+        output, strategy = repair_json(pre_processed_text)
+        code_action = output["code"]
+        if not isinstance(code_action, str):
+            raise TypeError("code is not a string")
+    except (ValueError, KeyError, TypeError):
+        code_action = extract_code_from_text(text, code_block_tags)
+        strategy = "code_block"
+    if code_action is None:
+        recovery_stats.failures += 1
+        raise error
+    recovery_stats.count_recovery(strategy)
+    return code_action
+
+
+class WrappedCodeAgent(AgentInstrumentationMixin, CodeAgent):
+    def __init__(
+        self,
+        *args,
+        stream_render_interval: float = 0.1,
+        stream_render_max_pending_chars: int | None = None,
+        speculative_execution: bool = False,
+        observation_capture: ObservationCapture | None = None,
+        **kwargs,
+    ):
+        self.stream_render_interval = stream_render_interval
+        self.stream_render_max_pending_chars = stream_render_max_pending_chars
+        # Run the code as soon as it is complete in the stream, see SpeculativeExecution
+        self.speculative_execution = speculative_execution
+        self.parsing_recovery_stats = ParsingRecoveryStats()
+        self.speculation_stats = SpeculationStats()
+        self.run_id = uuid.uuid4().hex
+        super().__init__(*args, **kwargs)
+        # Bounds the print outputs and output of the code, see ObservationCapture
+        self.observation_capture = observation_capture or ObservationCapture(
+            max_log_chars=self.max_print_outputs_length or DEFAULT_MAX_LEN_OUTPUT
+        )
+        self.observation_capture_stats = self.observation_capture.stats
+
+    def _console_sink(self) -> ConsoleSink:
+        return ConsoleSink(
+            self.logger,
+            render_interval=self.stream_render_interval,
+            max_pending_chars=self.stream_render_max_pending_chars,
+        )
+
+    def run(self, *args, **kwargs):
+        # Step numbers restart at each run, including runs with reset=False, so the
+        # files spilled by the observation capture are also keyed by run
+        self.run_id = uuid.uuid4().hex
+        return super().run(*args, **kwargs)
+
+    def _discard_speculation(self, speculation: SpeculativeExecution | None) -> None:
+        if speculation is not None:
+            speculation.wait()
+            self.speculation_stats.discarded += 1
+
+    def _record_print_outputs(self) -> str:
+        """Returns a note about the file the print outputs were spilled to, if any."""
+        print_outputs = getattr(self.python_executor, "state", {}).get("_print_outputs")
+        if print_outputs is None:
+            return ""
+        spill_path = self.observation_capture.record_logs(print_outputs)
+        if spill_path is None:
+            return ""
+        return f"The full execution logs were saved to {spill_path}\n"
+
     def _step_stream(
         self, memory_step: ActionStep
     ) -> Generator[ChatMessageStreamDelta | ToolCall | ToolOutput | ActionOutput]:
@@ -218,15 +635,45 @@ class WrappedCodeAgent(CodeAgent):
         Yields ChatMessageStreamDelta during the run if streaming is enabled.
         At the end, yields either None if the step is not final, or the final answer.
         """
-        memory_messages = self.write_memory_to_messages()
+        step_timer = self.ledger.start_step()
+        tracer = get_tracer()
+        self._step_span = tracer.start_span(
+            "agent.step", agent=self.name, step_number=memory_step.step_number
+        )
+        with tracer.span("agent.write_memory_to_messages"):
+            memory_messages = self.write_memory_to_messages()
 
         input_messages = memory_messages.copy()
         ### Generate model output ###
         memory_step.model_input_messages = input_messages
+        # Files spilled by the observation capture are named after the run and step
+        step_key = (
+            f"{self.name or 'agent'}_{self.run_id}_step_{memory_step.step_number}"
+        )
+        speculate = (
+            self.stream_outputs
+            and self.speculative_execution
+            and isinstance(self.python_executor, LocalPythonExecutor)
+        )
+        # With speculative execution, the output is cut after the code block once
+        # the stream ends, rather than stopped at its closing tag
+        cut_after_code_block = speculate and not self._use_structured_outputs_internally
         stop_sequences = ["Observation:", "Calling tools:"]
-        if self.code_block_tags[1] not in self.code_block_tags[0]:
+        # UPDATED: keep streaming past the closing tag with speculative execution,
+        # so that the code runs while the rest of the output is streamed.
+        # BEFORE:
+        # if self.code_block_tags[1] not in self.code_block_tags[0]:
+        # AFTER:
+        if (
+            self.code_block_tags[1] not in self.code_block_tags[0]
+            and not cut_after_code_block
+        ):
             # If the closing tag is contained in the opening tag, adding it as a stop sequence would cut short any code generation
             stop_sequences.append(self.code_block_tags[1])
+        # -------
+        generation_start_time = time.time()
+        speculation: SpeculativeExecution | None = None
+        stream_end_time = None
         try:
             additional_args: dict[str, Any] = {}
             if self._use_structured_outputs_internally:
@@ -237,36 +684,70 @@ class WrappedCodeAgent(CodeAgent):
                     stop_sequences=stop_sequences,
                     **additional_args,
                 )
-                chat_message_stream_deltas: list[ChatMessageStreamDelta] = []
-                with Live(
-                    "", console=self.logger.console, vertical_overflow="visible"
-                ) as live:
+                # UPDATED: fold deltas incrementally and send them to the event sink,
+                # which renders them, throttled (see ConsoleSink), or not.
+                # Re-agglomerating and re-rendering all deltas on every new delta is
+                # quadratic in the output length.
+                # BEFORE:
+                # chat_message_stream_deltas.append(event)
+                # live.update(Markdown(agglomerate_stream_deltas(chat_message_stream_deltas).render_as_markdown()))
+                # AFTER:
+                stream_accumulator = StreamAccumulator()
+                code_block_detector = (
+                    CodeBlockDetector(
+                        self.code_block_tags[1],
+                        structured=self._use_structured_outputs_internally,
+                        extract_code=lambda text: extract_code_from_text(
+                            text, self.code_block_tags
+                        ),
+                    )
+                    if speculate
+                    else None
+                )
+                with tracer.span("model.generate_stream", model_id=self.model.model_id):
                     for event in output_stream:
-                        chat_message_stream_deltas.append(event)
-                        live.update(
-                            Markdown(
-                                agglomerate_stream_deltas(
-                                    chat_message_stream_deltas
-                                ).render_as_markdown()
-                            )
-                        )
+                        stream_accumulator.add(event)
+                        if event.content:
+                            step_timer.mark_first_token(generation_start_time)
+                            if code_block_detector is not None and speculation is None:
+                                speculative_code = code_block_detector.feed(
+                                    event.content
+                                )
+                                if speculative_code is not None:
+                                    # The capture is part of the context of the speculation
+                                    with self.observation_capture.capturing(step_key):
+                                        speculation = SpeculativeExecution(
+                                            self.python_executor,
+                                            fix_final_answer_code(speculative_code),
+                                        )
+                                    self.speculation_stats.started += 1
+                        emit_event(self, "delta", memory_step.step_number, delta=event)
                         yield event
-                chat_message = agglomerate_stream_deltas(chat_message_stream_deltas)
+                stream_end_time = time.time()
+                chat_message = stream_accumulator.to_chat_message()
+                if cut_after_code_block and code_block_detector.code_end is not None:
+                    chat_message.content = chat_message.content[
+                        : code_block_detector.code_end
+                    ]
+                # -------
                 memory_step.model_output_message = chat_message
                 output_text = chat_message.content
             else:
-                chat_message: ChatMessage = self.model.generate(
-                    input_messages,
-                    stop_sequences=stop_sequences,
-                    **additional_args,
-                )
+                with tracer.span("model.generate", model_id=self.model.model_id):
+                    chat_message: ChatMessage = self.model.generate(
+                        input_messages,
+                        stop_sequences=stop_sequences,
+                        **additional_args,
+                    )
                 memory_step.model_output_message = chat_message
                 output_text = chat_message.content
-                self.logger.log_markdown(
-                    content=output_text,
-                    title="Output message of the LLM:",
-                    level=LogLevel.DEBUG,
-                )
+            emit_event(
+                self,
+                "model_output",
+                memory_step.step_number,
+                content=output_text,
+                streamed=self.stream_outputs,
+            )
 
             if not self._use_structured_outputs_internally:
                 # This adds the end code sequence (i.e. the closing code block tag) to the history.
@@ -279,36 +760,44 @@ class WrappedCodeAgent(CodeAgent):
 
             memory_step.token_usage = chat_message.token_usage
             memory_step.model_output = output_text
+            step_timer.generation_time = time.time() - generation_start_time
         except Exception as e:
+            self._discard_speculation(speculation)
             raise AgentGenerationError(
                 f"Error in generating model output:\n{e}", self.logger
             ) from e
 
         ### Parse output ###
-        try:
-            if self._use_structured_outputs_internally:
-                # UPDATED: add a pre-processing step to extract the json data.
-                # It helps with thinking models, which add their thoughts before
-                # the structured output.
-                # BEFORE:
-                # code_action = json.loads(output_text)["code"]
-                # AFTER:
-                pre_processed_output_text = extract_internal_structure_text(output_text)
-                code_action = json.loads(pre_processed_output_text)["code"]
-                # -------
-                code_action = (
-                    extract_code_from_text(code_action, self.code_block_tags)
-                    or code_action
-                )
-            else:
-                code_action = parse_code_blobs(output_text, self.code_block_tags)
-            code_action = fix_final_answer_code(code_action)
-            memory_step.code_action = code_action
-        except Exception as e:
-            error_msg = (
-                f"Error in code parsing:\n{e}\nMake sure to provide correct code blobs."
-            )
-            raise AgentParsingError(error_msg, self.logger)
+        parse_start_time = time.time()
+        with tracer.span("agent.parse"):
+            try:
+                if self._use_structured_outputs_internally:
+                    # UPDATED: add a pre-processing step to extract the json data.
+                    # It helps with thinking models, which add their thoughts before
+                    # the structured output.
+                    # BEFORE:
+                    # code_action = json.loads(output_text)["code"]
+                    # AFTER:
+                    code_action = parse_structured_code_action(
+                        output_text,
+                        self.code_block_tags,
+                        self.parsing_recovery_stats,
+                    )
+                    # -------
+                    code_action = (
+                        extract_code_from_text(code_action, self.code_block_tags)
+                        or code_action
+                    )
+                else:
+                    code_action = parse_code_blobs(output_text, self.code_block_tags)
+                code_action = fix_final_answer_code(code_action)
+                memory_step.code_action = code_action
+                step_timer.parse_time = time.time() - parse_start_time
+            except Exception as e:
+                self._discard_speculation(speculation)
+                report_parse_error(self.model)
+                error_msg = f"Error in code parsing:\n{e}\nMake sure to provide correct code blobs."
+                raise AgentParsingError(error_msg, self.logger)
 
         tool_call = ToolCall(
             name="python_interpreter",
@@ -319,18 +808,30 @@ class WrappedCodeAgent(CodeAgent):
         memory_step.tool_calls = [tool_call]
 
         ### Execute action ###
-        self.logger.log_code(
-            title="Executing parsed code:", content=code_action, level=LogLevel.INFO
-        )
+        emit_event(self, "code", memory_step.step_number, code=code_action)
         try:
-            code_output = self.python_executor(code_action)
-            execution_outputs_console = []
-            if len(code_output.logs) > 0:
-                execution_outputs_console += [
-                    Text("Execution logs:", style="bold"),
-                    Text(code_output.logs),
-                ]
+            with (
+                step_timer.measure("executor_time"),
+                tracer.span(
+                    "agent.python_executor", speculative=speculation is not None
+                ),
+            ):
+                # The speculative execution is only used if it ran the final code
+                if speculation is not None and speculation.code_action == code_action:
+                    self.speculation_stats.committed += 1
+                    try:
+                        code_output = speculation.commit()
+                    finally:
+                        self.speculation_stats.overlapped_time += (
+                            min(speculation.end_time, stream_end_time)
+                            - speculation.start_time
+                        )
+                else:
+                    self._discard_speculation(speculation)
+                    with self.observation_capture.capturing(step_key):
+                        code_output = self.python_executor(code_action)
             observation = "Execution logs:\n" + code_output.logs
+            spill_notes = self._record_print_outputs()
         except Exception as e:
             if (
                 hasattr(self.python_executor, "state")
@@ -338,33 +839,50 @@ class WrappedCodeAgent(CodeAgent):
             ):
                 execution_logs = str(self.python_executor.state["_print_outputs"])
                 if len(execution_logs) > 0:
-                    execution_outputs_console = [
-                        Text("Execution logs:", style="bold"),
-                        Text(execution_logs),
-                    ]
-                    memory_step.observations = "Execution logs:\n" + execution_logs
-                    self.logger.log(
-                        Group(*execution_outputs_console), level=LogLevel.INFO
+                    memory_step.observations = (
+                        "Execution logs:\n"
+                        + execution_logs
+                        + self._record_print_outputs()
+                    )
+                    emit_event(
+                        self,
+                        "observation",
+                        memory_step.step_number,
+                        logs=execution_logs,
+                        output=None,
                     )
+            # The warning about unauthorized imports is given by the sink, on the error event
             error_msg = str(e)
-            if "Import of " in error_msg and " is not allowed" in error_msg:
-                self.logger.log(
-                    "[bold red]Warning to user: Code execution failed due to an unauthorized import - Consider passing said import under `additional_authorized_imports` when initializing your CodeAgent.",
-                    level=LogLevel.INFO,
-                )
             raise AgentExecutionError(error_msg, self.logger)
 
-        truncated_output = truncate_content(str(code_output.output))
+        # UPDATED: render the output with a length limit, instead of rendering it in
+        # full before truncating it.
+        # BEFORE:
+        # truncated_output = truncate_content(str(code_output.output))
+        # AFTER:
+        with tracer.span("agent.truncate_observation"):
+            truncated_output, output_spill_path = (
+                self.observation_capture.render_output(code_output.output, step_key)
+            )
+        if output_spill_path is not None:
+            spill_notes += f"The full output was saved to {output_spill_path}\n"
+        # -------
         observation += "Last output from code snippet:\n" + truncated_output
+        if spill_notes:
+            observation += "\n" + spill_notes
         memory_step.observations = observation
 
-        if not code_output.is_final_answer:
-            execution_outputs_console += [
-                Text(
-                    f"Out: {truncated_output}",
-                ),
-            ]
-        self.logger.log(Group(*execution_outputs_console), level=LogLevel.INFO)
+        emit_event(
+            self,
+            "observation",
+            memory_step.step_number,
+            logs=code_output.logs,
+            output=None if code_output.is_final_answer else truncated_output,
+        )
+        if code_output.is_final_answer:
+            emit_event(
+                self, "final_answer", memory_step.step_number, output=code_output.output
+            )
         memory_step.action_output = code_output.output
         yield ActionOutput(
             output=code_output.output, is_final_answer=code_output.is_final_answer